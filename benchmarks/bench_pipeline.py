@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import zlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "sd_plugin"))
+
+import image_codec
+import sd_http
+
+#Runs the plug-in's request pipeline against the mock WebUI and writes the timings as JSON:
+#
+#   export   - in-memory PNG + base64 encoding of the canvas, as get_image_as_base64 does
+#   build    - JSON body of the request
+#   request  - upload, backend and download of the whole response
+#   parse    - json.loads of the response
+#   stream   - request and parse at once, as the job queue receives images
+#   decode   - base64 and PNG decoding of every returned image
+#
+#A parameter sweep over consecutive seeds is also timed as the plug-in sends it, one export and one batched
+#request, against one export and one request per seed.
+#
+#Exporting needs no GIMP, the canvas is synthetic. Decoding uses GdkPixbuf like the plug-in when it is
+#installed, and a plain zlib inflate of the PNG data otherwise.
+
+CANVAS_SIZES = [512, 1024, 2048]
+BATCH_SIZES = [1, 4]
+REPEATS = 5
+
+try:
+    import gi       # type: ignore
+    gi.require_version('GdkPixbuf', '2.0')
+    from gi.repository import GdkPixbuf
+
+    DECODER = "GdkPixbuf"
+
+    def decode_png(data):
+        loader = GdkPixbuf.PixbufLoader()
+        loader.write(data)
+        loader.close()
+
+        return loader.get_pixbuf()
+except (ImportError, ValueError):
+    DECODER = "zlib"
+
+    def decode_png(data):
+        position, idat = 8, []
+        while position < len(data):
+            length = int.from_bytes(data[position:position + 4], "big")
+            if data[position + 4:position + 8] == b"IDAT":
+                idat.append(data[position + 8:position + 8 + length])
+            position += length + 12
+
+        return zlib.decompress(b"".join(idat))
+
+#Shifted noisy gradients, between a flat canvas and a photograph for the encoder
+def canvas_strips(size):
+    noise = os.urandom(size * 2)
+    line = bytes((x * 255 // size + noise[x] % 16) & 255 for x in range(size * 2))
+    pixels = bytes(value for pixel in zip(line, line[::-1], line, b"\xff" * len(line)) for value in pixel)
+
+    for row in range(0, size, 64):
+        yield b"".join(pixels[(y * 7 % size) * 4:(y * 7 % size + size) * 4] for y in range(row, min(row + 64, size)))
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+
+    return result, time.perf_counter() - started
+
+class Pipeline:
+
+    def __init__(self, base_url, size, batch_size, gzip = ""):
+        self.session = sd_http.Session(timeout = 600, accept_gzip = gzip in ("response", "all"), gzip_requests = gzip == "all")
+        self.url = base_url + "sdapi/v1/img2img"
+        self.size = size
+        self.batch_size = batch_size
+        self.strips = list(canvas_strips(size))
+
+    def run(self):
+        stages = {}
+
+        (encoded, raw_size), stages["export"] = timed(image_codec.encode_png_base64, self.size, self.size, 4, iter(self.strips))
+
+        data = {
+            "prompt": "benchmark",
+            "init_images": [encoded],
+            "width": self.size,
+            "height": self.size,
+            "n_iter": 1,
+            "batch_size": self.batch_size,
+            "seed": 1,
+            "override_settings": {"return_grid": False}
+        }
+        body, stages["build"] = timed(lambda: json.dumps(data).encode())
+
+        before = self.session.stats()
+        response, stages["request"] = timed(self.session.request, "POST", self.url, body, {"Content-Type": "application/json"})
+        after = self.session.stats()
+        images, stages["parse"] = timed(lambda: response.json()["images"])
+
+        streamed, stages["stream"] = timed(lambda: list(self.session.post_json_stream(self.url, data, "images")))
+        assert streamed == images
+
+        _, stages["decode"] = timed(lambda: [decode_png(base64.b64decode(image)) for image in images])
+
+        return stages, {"upload_bytes": len(body), "download_bytes": len(response.data), "png_bytes": raw_size,
+                        "wire_bytes_sent": after["bytes_sent"] - before["bytes_sent"],
+                        "wire_bytes_received": after["bytes_received"] - before["bytes_received"]}
+
+    #Tracing slows everything down, the peak is measured apart from the timings
+    def peak_memory(self):
+        tracemalloc.start()
+        try:
+            self.run()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+def run_case(base_url, size, batch_size, repeats, gzip):
+    pipeline = Pipeline(base_url, size, batch_size, gzip)
+    pipeline.run()
+
+    runs = [pipeline.run() for index in range(repeats)]
+    stages = {name: {
+        "median_s": statistics.median(run[0][name] for run in runs),
+        "min_s": min(run[0][name] for run in runs)
+    } for name in runs[0][0]}
+
+    #The streamed request replaces request + parse in the plug-in
+    total = sum(stage["median_s"] for name, stage in stages.items() if name not in ("request", "parse"))
+
+    return {
+        "canvas": size,
+        "batch_size": batch_size,
+        "stages": stages,
+        "total_s": total,
+        "images_per_s": batch_size / total,
+        "peak_memory_mb": pipeline.peak_memory() / 2**20,
+        "connections": pipeline.session.stats(),
+        **runs[-1][1]
+    }
+
+def bench_sweep(base_url, size, seeds, repeats):
+    session = sd_http.Session(timeout = 600)
+    url = base_url + "sdapi/v1/img2img"
+    strips = list(canvas_strips(size))
+
+    def generate(batch_size, seed):
+        encoded = image_codec.encode_png_base64(size, size, 4, iter(strips))[0]
+        data = {"prompt": "benchmark", "init_images": [encoded], "width": size, "height": size, "n_iter": 1,
+                "batch_size": batch_size, "seed": seed, "override_settings": {"return_grid": False}}
+
+        return list(session.post_json_stream(url, data, "images"))
+
+    separate = [timed(lambda: [generate(1, seed) for seed in range(seeds)])[1] for index in range(repeats)]
+    sweep = [timed(generate, seeds, 0)[1] for index in range(repeats)]
+
+    return {"canvas": size, "variants": seeds, "separate_s": statistics.median(separate), "sweep_s": statistics.median(sweep)}
+
+def bench_metadata(base_url, repeats):
+    session = sd_http.Session(timeout = 10)
+    endpoints = ["sdapi/v1/sd-models", "sdapi/v1/options", "sdapi/v1/samplers", "sdapi/v1/schedulers", "sdapi/v1/upscalers",
+                 "sdapi/v1/latent-upscale-modes", "sdapi/v1/prompt-styles", "controlnet/model_list", "controlnet/module_list"]
+    timings = []
+
+    for index in range(repeats):
+        started = time.perf_counter()
+        for endpoint in endpoints:
+            session.get_json(base_url + endpoint)
+        timings.append(time.perf_counter() - started)
+
+    return {"endpoints": len(endpoints), "median_s": statistics.median(timings), "min_s": min(timings)}
+
+def start_mock(latency, image_latency):
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "mock_webui.py"), "--port", "0",
+                                "--latency", str(latency), "--image-latency", str(image_latency)],
+                               stdout=subprocess.PIPE, text=True)
+
+    return process, process.stdout.readline().strip()
+
+#Stages slower than the baseline by more than `tolerance` (a fraction), ignoring differences under a millisecond
+def compare(results, baseline, tolerance):
+    previous = {(case["canvas"], case["batch_size"]): case for case in baseline["results"]}
+    regressions = []
+
+    for case in results["results"]:
+        old = previous.get((case["canvas"], case["batch_size"]))
+        if old is None:
+            continue
+
+        for name, stage in case["stages"].items():
+            old_stage = old["stages"].get(name)
+            if old_stage and stage["median_s"] - old_stage["median_s"] > max(old_stage["median_s"] * tolerance, 1e-3):
+                regressions.append("%dpx x%d %s: %.4fs -> %.4fs" % (case["canvas"], case["batch_size"], name, old_stage["median_s"], stage["median_s"]))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the plug-in request pipeline against a mock WebUI")
+    parser.add_argument("--sizes", type=int, nargs="+", default=CANVAS_SIZES, help="Canvas sizes, in pixels per side")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--latency", type=float, default=0, help="Mock backend seconds per request")
+    parser.add_argument("--image-latency", type=float, default=0, help="Mock backend seconds per image")
+    parser.add_argument("--gzip", choices=["", "response", "all"], default="", help="Compressed transfers, as SD_PLUGIN_GZIP")
+    parser.add_argument("--sweep", type=int, default=4, help="Seeds of the sweep comparison, 0 skips it")
+    parser.add_argument("--url", help="Benchmark an already running WebUI or mock instead of starting one")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Previous output to compare with, exits with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    process, base_url = (None, args.url.rstrip("/") + "/") if args.url else start_mock(args.latency, args.image_latency)
+
+    try:
+        results = {
+            "meta": {
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "decoder": DECODER,
+                "latency": args.latency,
+                "image_latency": args.image_latency,
+                "repeats": args.repeats,
+                "gzip": args.gzip
+            },
+            "metadata": bench_metadata(base_url, args.repeats),
+            "results": []
+        }
+
+        for size in args.sizes:
+            for batch_size in args.batch_sizes:
+                case = run_case(base_url, size, batch_size, args.repeats, args.gzip)
+                results["results"].append(case)
+
+                print("%5dpx x%d  %s  total %.3fs  %.2f images/s  peak %.1f MB" % (
+                    size, batch_size,
+                    "  ".join("%s %.3fs" % (name, stage["median_s"]) for name, stage in case["stages"].items()),
+                    case["total_s"], case["images_per_s"], case["peak_memory_mb"]
+                ))
+
+        if args.sweep:
+            sweep = results["sweep"] = bench_sweep(base_url, args.sizes[0], args.sweep, args.repeats)
+            print("sweep of %d seeds at %dpx: %.3fs one by one, %.3fs batched" % (
+                sweep["variants"], sweep["canvas"], sweep["separate_s"], sweep["sweep_s"]))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+
+        for regression in regressions:
+            print("Regression: %s" % regression)
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import base64
+import gzip
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sd_plugin"))
+import image_codec
+
+#Stand-in for the A1111 WebUI API, answering with generated PNGs of the requested size after a configurable latency.
+#Run it on its own to point GIMP at it, or let bench_pipeline.py start it.
+
+METADATA = {
+    "sdapi/v1/sd-models": [{"title": "mock-v1.safetensors [0000000000]", "model_name": "mock-v1"},
+                           {"title": "mock-xl.safetensors [1111111111]", "model_name": "mock-xl"}],
+    "sdapi/v1/options": {"sd_model_checkpoint": "mock-v1.safetensors [0000000000]"},
+    "sdapi/v1/samplers": [{"name": name} for name in ["Euler a", "Euler", "DPM++ 2M", "DDIM"]],
+    "sdapi/v1/schedulers": [{"name": name.lower(), "label": name} for name in ["Automatic", "Karras", "Exponential"]],
+    "sdapi/v1/upscalers": [{"name": name} for name in ["None", "Lanczos", "R-ESRGAN 4x+"]],
+    "sdapi/v1/latent-upscale-modes": [{"name": "Latent"}, {"name": "Latent (nearest)"}],
+    "sdapi/v1/prompt-styles": [{"name": "Mock style", "prompt": "{prompt}, mock", "negative_prompt": ""}],
+    "controlnet/model_list": {"model_list": ["mock_canny [00000000]"]},
+    "controlnet/module_list": {"module_list": ["none", "canny"]},
+}
+
+#Side of the live preview images
+PREVIEW_SIZE = 64
+
+#Noise compresses about as badly as a photograph, so the PNG sizes are close to real results
+def make_png_base64(width, height):
+    return image_codec.encode_png_base64(width, height, 3, [os.urandom(width * 3 * min(64, height - row)) for row in range(0, height, 64)])[0]
+
+def png_size(base64_png):
+    header = base64.b64decode(base64_png[:44])
+    return struct.unpack(">II", header[16:24])
+
+class MockWebUI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency, image_latency):
+        super().__init__(address, MockHandler)
+        self.latency = latency
+        self.image_latency = image_latency
+        self.images = {}
+        self.lock = threading.Lock()
+        self.queue_lock = threading.Lock()
+        self.interrupted = threading.Event()
+        self.progress = {"started_at": None, "duration": 0, "job_count": 0}
+        self.progress_polls = 0
+        self.preview_polls = 0
+        self.options = METADATA["sdapi/v1/options"] | {"samples_format": "png", "jpeg_quality": 80, "webp_lossless": False}
+
+    def image(self, width, height):
+        with self.lock:
+            image = self.images.get((width, height))
+
+        if image is None:
+            image = make_png_base64(width, height)
+            with self.lock:
+                self.images[(width, height)] = image
+
+        return image
+
+    #One generation at a time, like the queue lock of the WebUI. Returns False when it was interrupted, the
+    #interrupt flag is cleared when a generation starts, like the WebUI does.
+    def generate(self, count):
+        duration = self.latency + self.image_latency * count
+
+        with self.queue_lock:
+            self.interrupted.clear()
+            with self.lock:
+                self.progress = {"started_at": time.time(), "duration": duration, "job_count": 1}
+
+            completed = not self.interrupted.wait(duration)
+
+            with self.lock:
+                self.progress = {"started_at": None, "duration": 0, "job_count": 0}
+
+        return completed
+
+    #Live previews are only rendered when they are not skipped, like the WebUI does
+    def progress_json(self, skip_current_image = True):
+        with self.lock:
+            progress = dict(self.progress)
+            self.progress_polls += 1
+            self.preview_polls += not skip_current_image
+
+        fraction, eta, preview = 0, 0, None
+        if progress["started_at"] is not None and progress["duration"] > 0:
+            elapsed = time.time() - progress["started_at"]
+            fraction, eta = min(elapsed / progress["duration"], 0.99), max(progress["duration"] - elapsed, 0)
+            if not skip_current_image:
+                preview = self.image(PREVIEW_SIZE, PREVIEW_SIZE)
+
+        return {
+            "progress": fraction,
+            "eta_relative": eta,
+            "state": {"job": "mock", "job_count": progress["job_count"], "sampling_step": 0, "sampling_steps": 0},
+            "current_image": preview,
+            "textinfo": None
+        }
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    #Headers and body are written separately, Nagle would hold the body back until the headers are acknowledged
+    disable_nagle_algorithm = True
+
+    def send_json(self, data, status = 200):
+        body = json.dumps(data).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+
+        #Same threshold and level as the WebUI's GZipMiddleware
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(body) >= 1000:
+            body = gzip.compress(body, 9)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def path_name(self):
+        return self.path.split("?")[0].strip("/")
+
+    def do_GET(self):
+        path = self.path_name()
+
+        if path == "sdapi/v1/progress":
+            return self.send_json(self.server.progress_json("skip_current_image=false" not in self.path))
+        if path == "sdapi/v1/options":
+            return self.send_json(self.server.options)
+        if path in METADATA:
+            return self.send_json(METADATA[path])
+
+        self.send_json({"detail": "Not Found"}, 404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        #The WebUI itself does not decode compressed requests, the mock behaves like a proxy in front of it
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        data = json.loads(body) if body else {}
+        server = self.server
+
+        match self.path_name():
+            case "sdapi/v1/txt2img" | "sdapi/v1/img2img":
+                count = data.get("n_iter", 1) * data.get("batch_size", 1)
+                if not server.generate(count):
+                    count = 0
+
+                image = server.image(data.get("width", 512), data.get("height", 512))
+                images = [image] * count
+                if count > 1 and data.get("override_settings", {}).get("return_grid", True):
+                    images.insert(0, image)
+
+                self.send_json({"images": images, "parameters": {}, "info": json.dumps({"seed": data.get("seed", -1)})})
+            case "sdapi/v1/extra-single-image":
+                width, height = png_size(data["image"])
+                scale = data.get("upscaling_resize", 2)
+                server.generate(1)
+
+                self.send_json({"image": server.image(round(width * scale), round(height * scale)), "html_info": ""})
+            case "rembg":
+                server.generate(1)
+                self.send_json({"image": server.image(*png_size(data["input_image"]))})
+            case "sdapi/v1/options":
+                server.options |= data
+                self.send_json({})
+            case "sdapi/v1/interrupt":
+                server.interrupted.set()
+                self.send_json({})
+            case "sdapi/v1/skip":
+                self.send_json({})
+            case _:
+                self.send_json({"detail": "Not Found"}, 404)
+
+    def log_message(self, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock A1111 WebUI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860, help="0 picks a free port, printed on startup")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds added to every generation request")
+    parser.add_argument("--image-latency", type=float, default=0, help="Seconds added per generated image")
+    args = parser.parse_args()
+
+    server = MockWebUI((args.host, args.port), args.latency, args.image_latency)
+    print("http://%s:%d/" % server.server_address, flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
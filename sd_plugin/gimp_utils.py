@@ -1,47 +1,783 @@
 #!/usr/bin/env python3
 import gi 
 gi.require_version('Gimp', '3.0')
+gi.require_version('Gegl', '0.4')
+gi.require_version('GdkPixbuf', '2.0')
 
-from gi.repository import Gimp, Gio
+from gi.repository import Gimp, Gegl, GdkPixbuf, Gio, GLib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import base64
+import hashlib
+import os
+import sys
+import time
 
-def get_image_as_base64(image):
-    #image = copy_image(image)
+import image_codec
+import sd_cache
+import sd_trace
+
+#zlib level used for uploaded PNGs, 0 disables compression
+PNG_COMPRESSION_LEVEL = 1
+
+#Format of the uploaded images: "png[:zlib level]", "webp[:quality|lossless]" or "jpeg[:quality]".
+#ControlNet hints only guide the generation and can use a lossy format of their own.
+UPLOAD_FORMAT = image_codec.format_from_env("SD_PLUGIN_UPLOAD_FORMAT", ("png", PNG_COMPRESSION_LEVEL))
+HINT_FORMAT = image_codec.format_from_env("SD_PLUGIN_HINT_FORMAT", UPLOAD_FORMAT)
+EXPORT_STRIP_ROWS = 64
+
+#Set to compare every in-memory export against the PNG temp file export of the same region on stderr. Memory
+#is not compared, the file is written by GIMP's own PNG plug-in in another process.
+EXPORT_REPORT = bool(os.environ.get("SD_PLUGIN_EXPORT_REPORT"))
+
+#Encoded exports are kept in memory for the current run and on disk for the following ones
+EXPORT_CACHE_BYTES = 256 * 2**20
+EXPORT_DISK_CACHE_BYTES = 512 * 2**20
+
+export_cache = sd_cache.LRUCache(EXPORT_CACHE_BYTES)
+export_disk_cache = sd_cache.DiskCache(os.path.join(sd_cache.CACHE_DIR, "exports"), EXPORT_DISK_CACHE_BYTES)
+
+#Keys exported while a dialog was open, only written to the disk cache once the run actually uses them
+speculative_keys = set()
+
+#Exports waiting to be written to the disk cache, by write_exports once their request is queued. The writer is
+#joined when the plug-in exits, so no entry is left half written.
+pending_writes = {}
+disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sd-export-cache")
+
+def write_exports():
+    while pending_writes:
+        key, encoded = pending_writes.popitem()
+        disk_writer.submit(lambda key, encoded: export_disk_cache.put(key, encoded.encode("ascii")), key, encoded)
+
+#Digests of the drawables under a region while they are reused, see reused_fingerprints
+pixel_digests = None
+
+#Even an export found in the cache reads its pixels to compute its key, see iter_fingerprint. Within this context,
+#which must not edit the image, they are read once per region, e.g. for the init image and the ControlNet hint
+#of the same generation.
+@contextmanager
+def reused_fingerprints():
+    global pixel_digests
+
+    pixel_digests = {}
+    try:
+        yield
+    finally:
+        pixel_digests = None
+
+#`exclude` is a layer left out of the composite, without hiding it in the image
+def get_image_as_base64(image, roi = None, transport = UPLOAD_FORMAT, exclude = None):
+    with sd_trace.span("fingerprint"):
+        key = export_fingerprint(image, roi, transport, exclude)
+
+    with sd_trace.span("export", cache="memory", format=transport[0]) as span:
+        encoded = export_cache.get(key)
+
+        if encoded is not None and key in speculative_keys:
+            speculative_keys.discard(key)
+            pending_writes[key] = encoded
+            span["cache"] = "speculative"
+        elif encoded is None:
+            data = export_disk_cache.get(key)
+            if data is not None:
+                encoded = data.decode("ascii")
+                span["cache"] = "disk"
+            else:
+                encoded = encode_image_base64(image, roi, transport, exclude)
+                pending_writes[key] = encoded
+                span["cache"] = "miss"
+
+            export_cache.put(key, encoded, len(encoded))
+
+        span["bytes"] = len(encoded)
+
+    return encoded
+
+#Drives a step generator to its end and returns its value, the step generators let the same code run
+#at once or spread over idle callbacks
+def run_steps(steps):
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+def is_same_item(item, other):
+    return other is not None and item.get_id() == other.get_id()
+
+def iter_visible_drawables(layers, exclude = None):
+    for layer in layers:
+        if not layer.get_visible() or is_same_item(layer, exclude):
+            continue
+
+        yield layer
+        #Layer groups can have a mask too
+        if layer.get_mask():
+            yield layer.get_mask()
+
+        if layer.is_group():
+            yield from iter_visible_drawables(layer.get_children(), exclude)
+
+#GIMP exposes no undo or dirty counter to plug-ins, so the fingerprint hashes the pixels under the region
+#along with the layer properties that change the composite. Reading them costs far less than encoding.
+#Yields after every strip and returns the hex digest.
+def iter_fingerprint(header, drawables, rect):
+    drawables = list(drawables)
+    digest = hashlib.blake2b(repr(header).encode())
+    region = (tuple(drawable.get_id() for drawable in drawables), rect)
+
+    pixels = pixel_digests.get(region) if pixel_digests is not None else None
+    if pixels is None:
+        pixels = yield from iter_pixel_digest(drawables, rect)
+        if pixel_digests is not None:
+            pixel_digests[region] = pixels
+
+    digest.update(pixels)
+
+    return digest.hexdigest()
+
+def iter_pixel_digest(drawables, rect):
+    x, y, width, height = rect
+    digest = hashlib.blake2b()
+
+    for drawable in drawables:
+        offset_x, offset_y = drawable.get_offsets()[1:]
+        drawable_width, drawable_height = drawable.get_width(), drawable.get_height()
+
+        properties = (drawable.get_id(), offset_x, offset_y, drawable_width, drawable_height, drawable.has_alpha())
+        if isinstance(drawable, Gimp.Layer):
+            properties += (drawable.get_opacity(), int(drawable.get_mode()), drawable.get_lock_alpha())
+            #A disabled mask is left out of the composite, a shown one replaces the layer
+            if drawable.get_mask():
+                properties += (drawable.get_apply_mask(), drawable.get_show_mask())
+        digest.update(repr(properties).encode())
+
+        if drawable.is_group():
+            continue
+
+        left, top = max(x - offset_x, 0), max(y - offset_y, 0)
+        right, bottom = min(x + width - offset_x, drawable_width), min(y + height - offset_y, drawable_height)
+
+        if left < right and top < bottom:
+            for strip in iter_drawable_strips(drawable, "R'G'B'A u8", left, top, right - left, bottom - top):
+                digest.update(strip)
+                yield
+
+    return digest.digest()
+
+def iter_export_fingerprint(image, roi, transport, exclude = None):
+    header = (image.get_id(), image.get_width(), image.get_height(), roi, transport, exclude and exclude.get_id())
+    rect = roi or (0, 0, image.get_width(), image.get_height())
+
+    return iter_fingerprint(header, iter_visible_drawables(image.get_layers(), exclude), rect)
+
+def export_fingerprint(image, roi, transport, exclude = None):
+    return run_steps(iter_export_fingerprint(image, roi, transport, exclude))
+
+def iter_mask_fingerprint(image, mask, roi, compression_level):
+    header = ("mask", image.get_id(), image.get_width(), image.get_height(), roi, compression_level)
+    drawables = [mask, mask.get_mask()] if isinstance(mask, Gimp.Layer) and mask.get_mask() else [mask]
+
+    return iter_fingerprint(header, drawables, roi or (0, 0, image.get_width(), image.get_height()))
+
+def encode_image_base64(image, roi = None, transport = UPLOAD_FORMAT, exclude = None):
+    if not EXPORT_REPORT:
+        return export_image_base64(image, roi, transport, exclude)
+
+    encoded, seconds = measure_export(export_image_base64, image, roi, transport, exclude)
+    file_encoded, file_seconds = measure_export(export_png_file_base64, image, roi, exclude)
+
+    print("Export %dx%d%s: in memory %s %.3fs / %.1f KB, PNG file %.3fs / %.1f KB, saved %.3fs / %.1f KB" % (
+        image.get_width(), image.get_height(), " (region %dx%d)" % roi[2:] if roi else "",
+        "%s:%s" % transport, seconds, len(encoded) / 1024,
+        file_seconds, len(file_encoded) / 1024,
+        file_seconds - seconds, (len(file_encoded) - len(encoded)) / 1024
+    ), file=sys.stderr)
+
+    return encoded
+
+def measure_export(export, *args):
+    started = time.perf_counter()
+    result = export(*args)
+
+    return result, time.perf_counter() - started
+
+def get_composite_layer(image, exclude = None):
+    layers = [layer for layer in image.get_layers() if layer.get_visible() and not is_same_item(layer, exclude)]
+
+    if len(layers) == 1 and not layers[0].is_group() \
+        and layers[0].get_offsets()[1:] == (0, 0) \
+        and (layers[0].get_width(), layers[0].get_height()) == (image.get_width(), image.get_height()) \
+        and layers[0].get_opacity() == 100 and not layers[0].get_mask():
+        return layers[0], None
+
+    #Merging a duplicate keeps the user's image untouched, GEGL shares the tiles until they are written
+    duplicate = image.duplicate()
+
+    if isinstance(exclude, Gimp.Layer) and is_same_item(exclude.get_image(), image):
+        item_at(duplicate, item_path(image, exclude)).set_visible(False)
+
+    return duplicate.merge_visible_layers(Gimp.MergeType.CLIP_TO_IMAGE), duplicate
+
+#Positions of the item and its parents, which locate the same item in a duplicate of the image
+def item_path(image, item):
+    path = []
+    while item is not None:
+        path.insert(0, image.get_item_position(item))
+        item = item.get_parent()
+
+    return path
+
+def item_at(image, path):
+    items = image.get_layers()
+    for position in path[:-1]:
+        items = items[position].get_children()
+
+    return items[path[-1]]
+
+def iter_drawable_strips(drawable, pixel_format, x, y, width, height):
+    buffer = drawable.get_buffer()
+
+    for row in range(y, y + height, EXPORT_STRIP_ROWS):
+        rectangle = Gegl.Rectangle.new(x, row, width, min(EXPORT_STRIP_ROWS, y + height - row))
+        yield buffer.get(rectangle, 1.0, pixel_format, Gegl.AbyssPolicy.CLAMP)
+
+#Region of interest: the selection bounds grown by `margin` on every side, clamped to the canvas
+def get_roi(image, margin = 0):
+    success, non_empty, x1, y1, x2, y2 = Gimp.Selection.bounds(image)
+    if not non_empty:
+        return None
+
+    x1, y1 = max(x1 - margin, 0), max(y1 - margin, 0)
+    x2, y2 = min(x2 + margin, image.get_width()), min(y2 + margin, image.get_height())
+
+    return (x1, y1, x2 - x1, y2 - y1)
+
+def export_image_base64(image, roi = None, transport = UPLOAD_FORMAT, exclude = None):
+    return run_steps(iter_export_image(image, roi, transport, exclude))
+
+def iter_export_image(image, roi = None, transport = UPLOAD_FORMAT, exclude = None):
+    layer, duplicate = get_composite_layer(image, exclude)
+
+    try:
+        return (yield from iter_encode_drawable(layer, roi or (0, 0, image.get_width(), image.get_height()), transport))
+    finally:
+        if duplicate is not None:
+            duplicate.delete()
+
+def encode_drawable_base64(drawable, rect, transport = UPLOAD_FORMAT):
+    return run_steps(iter_encode_drawable(drawable, rect, transport))
+
+#Yields after every strip and returns the base64 encoded image
+def iter_encode_drawable(drawable, rect, transport = UPLOAD_FORMAT):
+    name, option = transport
+    alpha = drawable.has_alpha() and name != "jpeg"
+    channels, pixel_format = (4, "R'G'B'A u8") if alpha else (3, "R'G'B' u8")
+    x, y, width, height = rect
+    strips = iter_drawable_strips(drawable, pixel_format, x, y, width, height)
+
+    if name == "png":
+        writer = image_codec.Base64Writer()
+        for data in image_codec.iter_png(width, height, channels, strips, option):
+            writer.write(data)
+            yield
+
+        return writer.getvalue()
+
+    #GdkPixbuf encodes the other formats from the whole region at once
+    pixels = []
+    for strip in strips:
+        pixels.append(strip)
+        yield
+
+    pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(b"".join(pixels)), GdkPixbuf.Colorspace.RGB, alpha, 8, width, height, width * channels)
+
+    return base64.b64encode(save_pixbuf(pixbuf, name, option)).decode("ascii")
+
+#Formats the installed GdkPixbuf savers refused, sent as PNG instead
+unsupported_formats = set()
+
+def save_pixbuf(pixbuf, name, option):
+    if (name, option) not in unsupported_formats:
+        keys, values = (["lossless"], ["true"]) if option == "lossless" else (["quality"], [str(option)])
+
+        try:
+            return pixbuf.save_to_bufferv(name, keys, values)[1]
+        except GLib.Error as error:
+            unsupported_formats.add((name, option))
+            print("Cannot encode %s:%s (%s), uploading PNG instead" % (name, option, error.message), file=sys.stderr)
+
+    return pixbuf.save_to_bufferv("png", ["compression"], [str(PNG_COMPRESSION_LEVEL)])[1]
+
+#Exports `roi` (or the canvas) through a PNG temp file, without `exclude`
+def export_png_file_base64(image, roi = None, exclude = None):
+    duplicate = None
+    if roi or exclude:
+        duplicate = image.duplicate()
+        if isinstance(exclude, Gimp.Layer) and is_same_item(exclude.get_image(), image):
+            item_at(duplicate, item_path(image, exclude)).set_visible(False)
+        if roi:
+            x, y, width, height = roi
+            duplicate.crop(width, height, x, y)
 
     procedure = Gimp.get_pdb().lookup_procedure('file-png-export'); 
     config = procedure.create_config(); 
     config.set_property('run-mode', Gimp.RunMode.NONINTERACTIVE); 
-    config.set_property('image', image); 
+    config.set_property('image', duplicate or image); 
     file = Gio.File.new_tmp()[0]
 
     config.set_property('file', file); 
     config.set_property('options', None);
     config.set_property('format', 'auto');
     result = procedure.run(config); 
-    success = result.index(0)
 
-    with open(file.get_path(), 'rb') as file:
-        return base64.b64encode(file.read()).decode("utf-8")
+    try:
+        if result.index(0) != Gimp.PDBStatusType.SUCCESS:
+            raise OSError("file-png-export failed: %s" % result.index(0).value_nick)
+
+        with open(file.get_path(), 'rb') as png:
+            encoded = base64.b64encode(png.read()).decode("utf-8")
+    finally:
+        os.remove(file.get_path())
+        if duplicate is not None:
+            duplicate.delete()
+
+    return encoded
+
+#The mask sent for inpainting, read from the mask drawable alone as grayscale over `roi` (or the canvas), the area
+#the init image covers. Transparent pixels and pixels outside the drawable are white, i.e. not inpainted.
+#Masks are always lossless PNG whatever the upload format, 1-bit when they hold only black and white.
+def get_mask_as_base64(image, mask, roi = None, compression_level = PNG_COMPRESSION_LEVEL):
+    with sd_trace.span("fingerprint", kind="mask"):
+        key = run_steps(iter_mask_fingerprint(image, mask, roi, compression_level))
+
+    #Masks encode quickly, they are only kept in memory
+    with sd_trace.span("export", kind="mask", cache="memory") as span:
+        encoded = export_cache.get(key)
+
+        if encoded is None:
+            encoded = encode_mask_base64(image, mask, roi, compression_level)
+            export_cache.put(key, encoded, len(encoded))
+            span["cache"] = "miss"
+
+        speculative_keys.discard(key)
+        span["bytes"] = len(encoded)
+
+    return encoded
+
+def encode_mask_base64(image, mask, roi = None, compression_level = PNG_COMPRESSION_LEVEL):
+    x, y, width, height = roi or (0, 0, image.get_width(), image.get_height())
+
+    offset_x, offset_y = mask.get_offsets()[1:]
+    covers = offset_x <= x and offset_y <= y \
+        and offset_x + mask.get_width() >= x + width and offset_y + mask.get_height() >= y + height
+
+    if covers and not mask.has_alpha() and not (isinstance(mask, Gimp.Layer) and mask.get_mask()):
+        strips = list(iter_drawable_strips(mask, "Y' u8", x - offset_x, y - offset_y, width, height))
+    else:
+        strips = read_flattened_mask(mask, x, y, width, height)
+
+    if image_codec.is_binary(strips):
+        strips = [image_codec.pack_bits(strip, width) for strip in strips]
+        return image_codec.encode_png_base64(width, height, 1, strips, compression_level, 1)[0]
+
+    return image_codec.encode_png_base64(width, height, 1, strips, compression_level)[0]
+
+#Flattens a copy of the mask over white in a temporary grayscale image, which also applies its alpha and layer mask
+def read_flattened_mask(mask, x, y, width, height):
+    temp_image = Gimp.Image.new(width, height, Gimp.ImageBaseType.GRAY)
+    temp_image.undo_disable()
+
+    try:
+        background = Gimp.Layer.new(temp_image, "Background", width, height, Gimp.ImageType.GRAY_IMAGE, 100.0, Gimp.LayerMode.NORMAL)
+        temp_image.insert_layer(background, None, 0)
+        background.fill(Gimp.FillType.WHITE)
+
+        offset_x, offset_y = mask.get_offsets()[1:]
+        layer = Gimp.Layer.new_from_drawable(mask, temp_image)
+        temp_image.insert_layer(layer, None, 0)
+        layer.set_offsets(offset_x - x, offset_y - y)
+        layer.set_opacity(100)
+        layer.set_visible(True)
+
+        flattened = temp_image.merge_visible_layers(Gimp.MergeType.CLIP_TO_IMAGE)
+
+        return list(iter_drawable_strips(flattened, "Y' u8", 0, 0, width, height))
+    finally:
+        temp_image.delete()
+
+def decode_pixbuf(data):
+    loader = GdkPixbuf.PixbufLoader()
+    loader.write(data)
+    loader.close()
+
+    return loader.get_pixbuf()
+
+#Exports the inputs of a run while its dialog is open, so pressing OK finds them in the export cache.
+#`plan` returns the exports the current values need, ("image", roi, transport, exclude) or ("mask", mask, roi), and is
+#called again whenever a value changes. PDB calls are bound to the main thread, so the exports advance one strip per
+#idle callback and the dialog stays responsive. Results stay in memory, a cancelled dialog leaves nothing behind.
+class SpeculativeExport:
+
+    def __init__(self, image, config, plan):
+        self.image = image
+        self.config = config
+        self.plan = plan
+        self.planned = None
+        self.tasks = deque()
+        self.source = None
+        self.handler = config.connect("notify", lambda config, spec: self.update())
+
+        self.update()
+
+    def update(self):
+        try:
+            exports = self.plan(self.config)
+        except Exception as error:
+            print("Speculative export skipped: %s" % error, file=sys.stderr)
+            exports = []
+
+        #Items are compared by id, GObject wrappers of the same item are not always the same Python object
+        planned = [tuple(value.get_id() if isinstance(value, Gimp.Item) else value for value in export) for export in exports]
+        if planned == self.planned:
+            return
+
+        self.planned = planned
+        self.stop_tasks()
+        self.tasks.extend(self.iter_export(*export) for export in exports)
+
+        if self.tasks and self.source is None:
+            self.source = GLib.idle_add(self.step)
+
+    def step(self):
+        try:
+            next(self.tasks[0])
+            return GLib.SOURCE_CONTINUE
+        except StopIteration:
+            pass
+        except Exception as error:
+            print("Speculative export failed: %s" % error, file=sys.stderr)
+
+        self.tasks.popleft()
+        if self.tasks:
+            return GLib.SOURCE_CONTINUE
+
+        self.source = None
+        return GLib.SOURCE_REMOVE
+
+    def iter_export(self, kind, *args):
+        if kind == "mask":
+            fingerprint = lambda: iter_mask_fingerprint(self.image, *args, PNG_COMPRESSION_LEVEL)
+            encode = lambda: iter_call(encode_mask_base64, self.image, *args)
+        else:
+            fingerprint = lambda: iter_export_fingerprint(self.image, *args)
+            encode = lambda: iter_export_image(self.image, *args)
+
+        key = yield from fingerprint()
+        if export_cache.contains(key):
+            return
+
+        data = export_disk_cache.get(key) if kind == "image" else None
+        if data is not None:
+            export_cache.put(key, data.decode("ascii"), len(data))
+            return
+
+        encoded = yield from encode()
+
+        #The image can be edited between idle callbacks, the result is only kept if it still matches
+        if (yield from fingerprint()) == key:
+            export_cache.put(key, encoded, len(encoded))
+            speculative_keys.add(key)
+
+    def stop_tasks(self):
+        while self.tasks:
+            self.tasks.popleft().close()
+
+    #Stops the remaining exports, closing them deletes the duplicates they work on
+    def cancel(self):
+        self.config.disconnect(self.handler)
+
+        if self.source is not None:
+            GLib.source_remove(self.source)
+            self.source = None
+
+        self.stop_tasks()
+
+#Runs a function as a single step
+def iter_call(function, *args):
+    yield
+    return function(*args)
+
+#Inserts the results of one job into `image`, all of them as a single undo step
+class ResultBatch:
+
+    def __init__(self, image):
+        self.image = image
+        self.undo_group = False
+
+    #Called before inserting a result, the first call opens the undo group
+    def start_undo_group(self):
+        if not self.undo_group:
+            self.image.undo_group_start()
+            self.undo_group = True
+
+    #Gives the job the input it asks for while it runs, only tiled jobs take some
+    def feed(self, job):
+        pass
+
+    #Called once the job is finished, one canvas resize for the whole batch instead of one per result
+    def finish(self):
+        if self.undo_group:
+            with sd_trace.span("insert"):
+                self.image.resize_to_layers()
+
+            self.image.undo_group_end()
+            self.undo_group = False
+
+    def close(self):
+        self.finish()
+
+    def result_layers(self):
+        return []
+
+#The backend generates sizes that are multiples of this many pixels
+LATENT_GRID = 8
+
+#Results can be added over several polls, e.g. once per batch of results received from a running job
+class LayerBatch(ResultBatch):
+
+    def __init__(self, image, group = False, name = "Generated images", roi = None):
+        super().__init__(image)
+        self.use_group = group
+        self.group = None
+        self.name = name
+        self.roi = roi
+        self.count = 0
+        self.layers = []
+
+        selection_pos = Gimp.Selection.bounds(image)
+        self.offsets = (selection_pos.x1, selection_pos.y1)
+        self.selection = (selection_pos.x1, selection_pos.y1, selection_pos.x2 - selection_pos.x1, selection_pos.y2 - selection_pos.y1)
+
+    def add(self, base64_img):
+        self.start_undo_group()
+
+        if self.use_group and self.group is None:
+            self.group = Gimp.GroupLayer.new(self.image, self.name)
+            self.image.insert_layer(self.group, None, 0)
+
+        with sd_trace.span("decode", bytes=len(base64_img)):
+            pixbuf = decode_pixbuf(base64.b64decode(base64_img))
+        self.count += 1
+
+        with sd_trace.span("insert"):
+            layer = Gimp.Layer.new_from_pixbuf(self.image, "%s #%d" % (self.name, self.count), pixbuf, 100.0, Gimp.LayerMode.NORMAL, 0.0, 1.0)
+            self.image.insert_layer(layer, self.group, 0)
+
+            if self.roi:
+                self.place_in_roi(layer)
+            else:
+                layer.set_offsets(*self.offsets)
+
+        self.layers.append(layer)
+        return layer
+
+    #The result covers the whole region of interest, only the selection is kept
+    def place_in_roi(self, layer):
+        roi_x, roi_y, roi_width, roi_height = self.roi
+        x, y, width, height = self.selection
+
+        #Anything larger than the rounding to the latent grid is an upscale, e.g. Hires. fix, and is kept whole
+        if max(abs(layer.get_width() - roi_width), abs(layer.get_height() - roi_height)) >= LATENT_GRID:
+            layer.set_offsets(roi_x, roi_y)
+            return
+
+        if (layer.get_width(), layer.get_height()) != (roi_width, roi_height):
+            layer.scale(roi_width, roi_height, False)
+
+        layer.set_offsets(roi_x, roi_y)
+        layer.resize(width, height, roi_x - x, roi_y - y)
+        layer.set_offsets(x, y)
+
+    def result_layers(self):
+        return self.layers
+
+#Pixels between the cells of a sweep grid, and size of the labels above them
+SWEEP_GRID_GAP = 16
+SWEEP_LABEL_SIZE = 20
+SWEEP_LABEL_HEIGHT = 32
+
+#Results of a parameter sweep in a layer group, every layer named after its variant. The grid layout places them
+#in rows of `columns` from the selection, each under a text layer with its label. `report` returns a summary of
+#the sweep shown once it is closed, or None.
+class SweepBatch(LayerBatch):
+
+    def __init__(self, image, labels, columns, grid = False, roi = None, report = None):
+        super().__init__(image, group = True, name = "Sweep", roi = roi)
+        self.labels = labels
+        self.columns = columns
+        self.grid = grid
+        self.report = report
+
+    def add(self, base64_img):
+        layer = super().add(base64_img)
+        index = self.count - 1
+
+        if index < len(self.labels):
+            layer.set_name(self.labels[index])
+
+        if self.grid:
+            with sd_trace.span("insert"):
+                self.place_in_grid(layer, index)
+
+        return layer
+
+    def place_in_grid(self, layer, index):
+        row, column = divmod(index, self.columns)
+        x = self.offsets[0] + column * (layer.get_width() + SWEEP_GRID_GAP)
+        y = self.offsets[1] + row * (layer.get_height() + SWEEP_LABEL_HEIGHT + SWEEP_GRID_GAP) + SWEEP_LABEL_HEIGHT
+        layer.set_offsets(x, y)
+
+        label = Gimp.TextLayer.new(self.image, layer.get_name(), Gimp.context_get_font(), SWEEP_LABEL_SIZE, Gimp.Unit.pixel())
+        self.image.insert_layer(label, self.group, 0)
+        label.set_offsets(x, y - SWEEP_LABEL_HEIGHT)
+
+    def close(self):
+        super().close()
+
+        message = self.report() if self.report else None
+        if message:
+            Gimp.message(message)
+
+#Exports `region` tile by tile while the job has room for more, and stitches the results scaled by `scale`
+#into a single layer at `offsets`, in row order, each tile fading in over the tiles above and left of it
+class TiledBatch(ResultBatch):
+
+    def __init__(self, image, region, offsets, scale, tile_size, overlap, request, name = "Tiled result"):
+        super().__init__(image)
+        self.scale = scale
+        self.request = request
+        self.name = name
+
+        x, y, width, height = region
+        overlap = min(overlap, tile_size // 2)
+        columns = image_codec.split_axis(x, width, tile_size, overlap)
+        rows = image_codec.split_axis(y, height, tile_size, overlap)
+
+        self.tiles = []
+        for row, (tile_y, tile_height) in enumerate(rows):
+            for column, (tile_x, tile_width) in enumerate(columns):
+                left = columns[column - 1][0] + columns[column - 1][1] - tile_x if column else 0
+                top = rows[row - 1][0] + rows[row - 1][1] - tile_y if row else 0
+                self.tiles.append((tile_x, tile_y, tile_width, tile_height, left, top))
+
+        self.region = region
+        self.offsets = offsets
+
+        self.job = None
+        self.layer = None
+        self.layer_type = None
+        self.composite = None
+        self.duplicate = None
+        self.received = {}
+        self.placed = 0
+
+    def feed(self, job):
+        self.job = job
+
+        while job.wants_input():
+            x, y, width, height, left, top = self.tiles[job.fed]
+
+            with sd_trace.span("export", tile=job.fed) as span:
+                if self.composite is None:
+                    self.composite, self.duplicate = get_composite_layer(self.image)
+                    self.layer_type = self.composite.type_with_alpha()
+
+                tile = encode_drawable_base64(self.composite, (x, y, width, height))
+                span["bytes"] = len(tile)
+
+            job.feed(job.fed, self.request(tile, width, height))
+
+        if job.fed == len(self.tiles):
+            self.release_composite()
+
+    def add(self, result):
+        self.start_undo_group()
+
+        index, base64_img = result
+        self.received[index] = base64_img
+
+        while self.placed in self.received:
+            self.place(self.tiles[self.placed], self.received.pop(self.placed))
+            self.placed += 1
+            self.job.release_tile()
+
+    #Position relative to the region, in result pixels
+    def dest(self, value):
+        return round(value * self.scale)
+
+    def place(self, tile, base64_img):
+        x, y, width, height, left, top = tile
+        region_x, region_y, region_width, region_height = self.region
+        x, y = x - region_x, y - region_y
+
+        if self.layer is None:
+            self.layer = Gimp.Layer.new(self.image, self.name, self.dest(region_width), self.dest(region_height),
+                                        self.layer_type, 100.0, Gimp.LayerMode.NORMAL)
+            self.image.insert_layer(self.layer, None, 0)
+            self.layer.set_offsets(*self.offsets)
+
+        tile_width, tile_height = self.dest(x + width) - self.dest(x), self.dest(y + height) - self.dest(y)
+
+        with sd_trace.span("decode", bytes=len(base64_img)):
+            pixbuf = decode_pixbuf(base64.b64decode(base64_img))
+
+        with sd_trace.span("insert"):
+            self.stitch(pixbuf, x, y, tile_width, tile_height, left, top)
+
+    def stitch(self, pixbuf, x, y, tile_width, tile_height, left, top):
+        layer = Gimp.Layer.new_from_pixbuf(self.image, self.name, pixbuf, 100.0, Gimp.LayerMode.NORMAL, 0.0, 1.0)
+        self.image.insert_layer(layer, None, self.image.get_item_position(self.layer))
+
+        if (layer.get_width(), layer.get_height()) != (tile_width, tile_height):
+            layer.scale(tile_width, tile_height, False)
+        layer.set_offsets(self.offsets[0] + self.dest(x), self.offsets[1] + self.dest(y))
+
+        if left or top:
+            mask = layer.create_mask(Gimp.AddMaskType.WHITE)
+            layer.add_mask(mask)
+
+            buffer = mask.get_buffer()
+            buffer.set(Gegl.Rectangle.new(0, 0, tile_width, tile_height), "Y u8",
+                       image_codec.ramp_mask(tile_width, tile_height, self.dest(left), self.dest(top)))
+            buffer.flush()
+            mask.update(0, 0, tile_width, tile_height)
+
+        self.layer = self.image.merge_down(layer, Gimp.MergeType.EXPAND_AS_NECESSARY)
 
-def copy_layer(image, layer):
-    layer = layer.copy()
-    image.insert_layer(layer, None, 0)
-    layer.flatten()
-    layer.set_opacity(100)
+    def close(self):
+        super().close()
+        self.release_composite()
 
-    return layer
+    def release_composite(self):
+        if self.duplicate is not None:
+            self.duplicate.delete()
 
-def load_base64_image(base64_img, image):
-    file, stream = Gio.File.new_tmp()
-    stream.get_output_stream().write(base64.b64decode(base64_img), None)
-    stream.close()
+        self.composite = self.duplicate = None
 
-    load_file_in_layer(image, file)
+    def result_layers(self):
+        return [self.layer] if self.layer is not None else []
 
-def load_file_in_layer(image, file):
-    layer = Gimp.file_load_layer(Gimp.RunMode.NONINTERACTIVE, image, file)
-    selection_pos = Gimp.Selection.bounds(image)
-    layer.set_offsets(selection_pos.x1, selection_pos.y1)
+#Copies `layer` into a new single layer image and saves it, the format follows the extension of `path`
+def save_layer(layer, path):
+    output = Gimp.Image.new(layer.get_width(), layer.get_height(), Gimp.ImageBaseType.RGB)
+    copy = Gimp.Layer.new_from_drawable(layer, output)
+    output.insert_layer(copy, None, 0)
+    copy.set_offsets(0, 0)
 
-    image.insert_layer(layer, None, 0)
-    image.resize_to_layers()
\ No newline at end of file
+    try:
+        Gimp.file_save(Gimp.RunMode.NONINTERACTIVE, output, Gio.File.new_for_path(path), None)
+    finally:
+        output.delete()
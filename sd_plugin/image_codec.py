@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import base64
+import os
+import struct
+import sys
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+#PNG color types by number of channels
+PNG_COLOR_TYPES = {
+    1: 0,
+    2: 4,
+    3: 2,
+    4: 6
+}
+
+#Default option of every transport format: zlib level for PNG, quality for the lossy formats
+FORMAT_DEFAULTS = {
+    "png": 1,
+    "webp": 90,
+    "jpeg": 90
+}
+
+#Parses "png[:level]", "webp[:quality|lossless]" or "jpeg[:quality]" into a (format, option) pair, None when empty
+def parse_format(spec):
+    if not spec:
+        return None
+
+    name, _, option = spec.lower().partition(":")
+    name = "jpeg" if name == "jpg" else name
+
+    if name not in FORMAT_DEFAULTS:
+        raise ValueError("Unknown image format '%s', expected one of %s" % (name, ", ".join(FORMAT_DEFAULTS)))
+
+    if not option:
+        return name, FORMAT_DEFAULTS[name]
+    if option == "lossless" and name == "webp":
+        return name, option
+
+    return name, int(option)
+
+#Format set in an environment variable, or `default`. A malformed value is reported and ignored, so that it
+#cannot keep the plug-in from loading.
+def format_from_env(variable, default = None):
+    spec = os.environ.get(variable)
+
+    try:
+        return parse_format(spec) or default
+    except ValueError as error:
+        print("Ignoring %s=%s: %s" % (variable, spec, error), file=sys.stderr)
+        return default
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)))
+
+#Yields the PNG file piece by piece from strips of raw rows, only one strip is held at a time.
+#Rows are 8-bit, or packed 8 pixels per byte for 1-bit grayscale.
+def iter_png(width, height, channels, strips, compression_level = 1, bit_depth = 8):
+    yield PNG_SIGNATURE
+    yield png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, PNG_COLOR_TYPES[channels], 0, 0, 0))
+
+    compressor = zlib.compressobj(compression_level)
+    stride = (width * channels * bit_depth + 7) // 8
+
+    for strip in strips:
+        rows = [b""]
+        for offset in range(0, len(strip), stride):
+            rows.append(strip[offset:offset + stride])
+
+        #Filter type 0 before every row, fast levels gain little from smarter filters
+        data = compressor.compress(b"\x00".join(rows))
+        if data:
+            yield png_chunk(b"IDAT", data)
+
+    yield png_chunk(b"IDAT", compressor.flush())
+    yield png_chunk(b"IEND", b"")
+
+class Base64Writer:
+
+    def __init__(self):
+        self.parts = []
+        self.remainder = b""
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        data = self.remainder + data
+        cut = len(data) - len(data) % 3
+
+        self.parts.append(base64.b64encode(data[:cut]))
+        self.remainder = data[cut:]
+
+    def getvalue(self):
+        self.parts.append(base64.b64encode(self.remainder))
+        self.remainder = b""
+
+        return b"".join(self.parts).decode("ascii")
+
+def encode_png_base64(width, height, channels, strips, compression_level = 1, bit_depth = 8):
+    writer = Base64Writer()
+
+    for data in iter_png(width, height, channels, strips, compression_level, bit_depth):
+        writer.write(data)
+
+    return writer.getvalue(), writer.size
+
+BINARY_VALUES = b"\x00\xff"
+BIT_CHARACTERS = bytes.maketrans(BINARY_VALUES, b"01")
+
+def is_binary(strips):
+    return all(not strip.translate(None, BINARY_VALUES) for strip in strips)
+
+#Packs 8-bit grayscale rows holding only 0 and 255 into 1-bit rows, through the C parser of binary numbers
+def pack_bits(strip, width):
+    padding = b"0" * (-width % 8)
+    rows = []
+
+    for offset in range(0, len(strip), width):
+        bits = strip[offset:offset + width].translate(BIT_CHARACTERS) + padding
+        rows.append(int(bits, 2).to_bytes(len(bits) // 8, "big"))
+
+    return b"".join(rows)
+
+#Splits [start, start + length) into evenly spaced (start, size) spans of at most `tile` pixels overlapping by at least `overlap`
+def split_axis(start, length, tile, overlap):
+    if length <= tile:
+        return [(start, length)]
+
+    count = -(-(length - overlap) // (tile - overlap))
+    return [(start + round(index * (length - tile) / (count - 1)), tile) for index in range(count)]
+
+CLIP_TABLES = [bytes(min(value, limit) for value in range(256)) for limit in range(256)]
+
+def ramp(size, fade):
+    return bytes(min(255, round(255 * (index + 0.5) / fade)) if index < fade else 255 for index in range(size))
+
+#8-bit mask fading in over the first `left` columns and `top` rows
+def ramp_mask(width, height, left, top):
+    columns = ramp(width, left)
+
+    return b"".join(columns.translate(CLIP_TABLES[value]) for value in ramp(height, top))
@@ -1,136 +1,928 @@
 #!/usr/bin/env python3
-from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from collections import deque
+import base64
+import hashlib
 import json
+import os
+import random
 import threading
+import time
 import gi       # type: ignore
 
+import image_codec
+import sd_cache
+import sd_http
+import sd_trace
+from sd_metadata import SD_BASE_URLS, SD_BASE_URL, API_PATH
+
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, GLib
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import Gtk, GdkPixbuf, Gio, GLib
 
-SD_BASE_URL = "http://127.0.0.1:7860/"
-SD_API_URL = SD_BASE_URL + "sdapi/v1/"
+#Seconds between two health checks of a backend
+BACKEND_CHECK_INTERVAL = 10
+BACKEND_CHECK_TIMEOUT = 2
 
 BASE_CONFIG = {
     "save_images": True
 }
 
-def get_list_from_api(uri, param_name):
-    list = []
-
-    for element in get_request(uri):
-        list.append(element[param_name])
-
-    return list
-
-def get_models():
-    return get_list_from_api("sd-models", "title")
-
-def get_upscaler_models():
-    return get_list_from_api("upscalers", "name")
-
-def get_latent_upscale_modes():
-    return get_list_from_api("latent-upscale-modes", "name")
-
-def get_samplers():
-    return get_list_from_api("samplers", "name")
-
-def get_schedulers():
-    return get_list_from_api("schedulers", "label")
-
-def get_rembg_models():
-    #Hardcoded in base module, not accessible by API
-    return [    
-        "None",
-        "isnet-general-use",
-        "isnet-anime",
-        "u2net",
-        "u2netp",
-        "u2net_human_seg",
-        "u2net_cloth_seg",
-        "silueta"
-    ]
-
-def get_controlnet_models():
-    return get_request("controlnet/model_list", SD_BASE_URL)["model_list"]
+#Timeout in seconds of the short API calls, and of connecting and sending a generation. A generation gets no
+#timeout for its response, the WebUI only answers once it is done, which can take minutes on slow hardware.
+HTTP_TIMEOUT = 30
+HTTP_RETRIES = 2
+
+#"response" asks for gzip compressed responses, which the WebUI supports. "all" also compresses the requests,
+#for backends behind a proxy decoding them, the WebUI alone rejects them.
+GZIP = os.environ.get("SD_PLUGIN_GZIP", "")
+
+session = sd_http.Session(timeout = HTTP_TIMEOUT, retries = HTTP_RETRIES, accept_gzip = GZIP in ("response", "all"), gzip_requests = GZIP == "all")
+
+#Format the backends encode their results in. The WebUI restores per request settings before encoding the
+#response, so this sets its global "samples_format" option while the plug-in's requests run.
+DOWNLOAD_FORMAT = image_codec.format_from_env("SD_PLUGIN_DOWNLOAD_FORMAT")
+WEBUI_FORMATS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+def download_options(transport):
+    name, option = transport
+    options = {"samples_format": WEBUI_FORMATS[name]}
+
+    if option == "lossless":
+        options["webp_lossless"] = True
+    elif name != "png":
+        options |= {"jpeg_quality": option, "webp_lossless": False}
+
+    return options
+
+class Backend:
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.healthy = True
+        self.busy = False
+        self.active = 0
+        self.checked_at = 0
+        self.requests = 0
+        #The WebUI's own values of the download options while they are replaced, None otherwise
+        self.saved_options = None
+        self.lock = threading.Lock()
+
+        #(checkpoint, refiner) of the last job or pre-warm sent to this backend, None while unknown
+        self.checkpoint = None
+
+    def load(self):
+        return self.active + self.busy
+
+    def check(self):
+        try:
+            progress_json = session.get_json(self.base_url + API_PATH + "progress?skip_current_image=true", timeout = BACKEND_CHECK_TIMEOUT)
+            self.healthy = True
+            #Work queued by other clients of the same WebUI
+            self.busy = progress_json["state"]["job_count"] > 0 or progress_json["progress"] > 0
+        except (OSError, ValueError, KeyError):
+            self.healthy = False
+
+        self.checked_at = time.time()
+
+    #Applies the download format before a request. The WebUI's values are restored once no request of the
+    #plug-in runs on this backend, so that the images it saves and its other clients keep their format.
+    def configure(self):
+        with self.lock:
+            self.requests += 1
+
+            if DOWNLOAD_FORMAT is not None and self.saved_options is None:
+                options = download_options(DOWNLOAD_FORMAT)
+                current = session.get_json(self.base_url + API_PATH + "options")
+                session.post_json(self.base_url + API_PATH + "options", options)
+                self.saved_options = {name: current[name] for name in options if name in current}
+
+    #Called after every request, whether configure succeeded or not
+    def restore(self):
+        with self.lock:
+            self.requests -= 1
+
+            if self.requests == 0 and self.saved_options is not None:
+                try:
+                    session.post_json(self.base_url + API_PATH + "options", self.saved_options)
+                    self.saved_options = None
+                except (OSError, ValueError):
+                    #Retried after the next request on this backend
+                    pass
+
+class BackendPool:
+
+    def __init__(self, base_urls):
+        self.backends = [Backend(base_url) for base_url in base_urls]
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=len(self.backends), thread_name_prefix="sd-health")
+
+    def __len__(self):
+        return len(self.backends)
+
+    #Checks the outdated backends, waiting up to BACKEND_CHECK_TIMEOUT for them. Never called on the main thread.
+    def refresh(self):
+        outdated = [backend for backend in self.backends if time.time() - backend.checked_at > BACKEND_CHECK_INTERVAL]
+        wait([self.executor.submit(backend.check) for backend in outdated])
+
+    #The backends that answered their last check, or the first one when none did. Never waits for them, backends
+    #not checked yet count as healthy.
+    def healthy(self):
+        return [backend for backend in self.backends if backend.healthy] or self.backends[:1]
+
+    #Between equally loaded backends, one that already has the checkpoint loaded
+    def acquire(self, checkpoint = None):
+        self.refresh()
+        backends = self.healthy()
+
+        with self.lock:
+            backend = min(backends, key=lambda backend: (backend.load(), checkpoint is not None and backend.checkpoint != checkpoint))
+            backend.active += 1
+
+        return backend
+
+    def release(self, backend):
+        with self.lock:
+            backend.active -= 1
+
+backend_pool = BackendPool(SD_BASE_URLS)
+
+#Upscales, background removals and generations with a fixed seed return the same images for the same payload,
+#they are answered from disk without contacting a backend
+RESULT_CACHE_BYTES = 1024 * 2**20
+
+result_cache = sd_cache.DiskCache(os.path.join(sd_cache.CACHE_DIR, "results"), RESULT_CACHE_BYTES)
+
+def is_deterministic(data, key):
+    return key == "image" or data.get("seed", -1) != -1
+
+#The payload holds the base64 input images, so the key covers their content too
+def result_key(path, data, key):
+    return hashlib.blake2b(json.dumps([path, key, data], sort_keys=True).encode()).hexdigest()
+
+def expected_results(data, key):
+    return data.get("n_iter", 1) * data.get("batch_size", 1) if key == "images" else 1
+
+def interrupt(base_url = SD_BASE_URL):
+    session.request("POST", base_url + API_PATH + "interrupt", b"")
+
+def skip(base_url = SD_BASE_URL):
+    session.request("POST", base_url + API_PATH + "skip", b"")
+
+#Sends `request`, interrupt or skip, to the backends without blocking the GTK main thread. A backend that
+#cannot be reached has nothing left to stop.
+def send_to_backends(request, base_urls):
+    def send(base_url):
+        try:
+            request(base_url)
+        except OSError:
+            pass
+
+    for base_url in base_urls:
+        threading.Thread(target=send, args=(base_url,), name="sd-interrupt", daemon=True).start()
+
+class Job:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, label, task):
+        self.label = label
+        self.task = task
+        self.status = Job.QUEUED
+        self.error = None
+        self.cancel_requested = False
+        self.trace = sd_trace.NULL_RUN
+
+        #Set for jobs running on a checkpoint, see job_checkpoint
+        self.checkpoint = None
+        self.skipped = 0
+
+        #Filled by the worker thread, drained by the main thread
+        self.results = deque()
+        self.image_count = 0
+        self.backends = []
+
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self):
+        with self.trace.bound():
+            for result in self.task(self):
+                self.results.append(result)
+                self.image_count += 1
+
+    def take_results(self):
+        results = []
+        while self.results:
+            results.append(self.results.popleft())
+
+        return results
+
+    def is_finished(self):
+        return self.status in (Job.DONE, Job.FAILED, Job.CANCELLED)
+
+    #Sends a request to the least loaded backend, unless the result is already cached
+    def post(self, path, data, key, cacheable = None):
+        if cacheable is None:
+            cacheable = is_deterministic(data, key)
+        cache_key = result_key(path, data, key) if cacheable else None
+
+        with sd_trace.span("cache") as span:
+            cached = result_cache.get(cache_key) if cache_key else None
+            span["hit"] = cached is not None
+
+        if cached is not None:
+            yield from json.loads(cached)
+            return
+
+        backend = backend_pool.acquire(self.checkpoint)
+        self.backends.append(backend)
+        #Only results that will be cached are kept, the others are let go of once the consumer has them
+        results = [] if cache_key else None
+        count = 0
+
+        if self.checkpoint is not None:
+            backend.checkpoint = self.checkpoint
+
+        try:
+            backend.configure()
+
+            with progress_poller.watching(backend.base_url):
+                if key == "images":
+                    responses = session.post_json_stream(backend.base_url + path, data, key, read_timeout = sd_http.UNBOUNDED)
+                else:
+                    responses = [session.post_json(backend.base_url + path, data, read_timeout = sd_http.UNBOUNDED)[key]]
+
+                for result in responses:
+                    count += 1
+                    if results is not None:
+                        results.append(result)
+                    yield result
+        finally:
+            backend.restore()
+            backend_pool.release(backend)
+
+        #A skipped or interrupted generation returns fewer images
+        if cache_key and not self.cancel_requested and count == expected_results(data, key):
+            result_cache.put(cache_key, json.dumps(results).encode())
+
+    #Splits the batch count into requests and yields the images in the order a single request would.
+    #Progressive jobs send one request per batch, keeping PIPELINE_DEPTH of them queued on every backend so that
+    #each batch is inserted as soon as it is done without leaving the backend idle. Other jobs only split the
+    #batch count between the healthy backends.
+    def post_split(self, path, data, progressive = False):
+        backend_pool.refresh()
+        backends = len(backend_pool.healthy())
+        n_iter = data.get("n_iter", 1)
+        count = n_iter if progressive else min(backends, n_iter)
+
+        if count < 2:
+            yield from self.post(path, data, "images")
+            return
+
+        cacheable = is_deterministic(data, "images")
+        batch_size, seed = data.get("batch_size", 1), data.get("seed", -1)
+
+        #Draw the seed like the WebUI would for a single request, the following images use the next seeds
+        if seed == -1:
+            seed = random.randrange(4294967294)
+
+        requests = []
+        start = 0
+
+        for index in range(count):
+            part_iter = n_iter // count + (index < n_iter % count)
+            requests.append(data | {"n_iter": part_iter, "seed": seed + start * batch_size})
+            start += part_iter
+
+        yield from self.post_parts(path, requests, cacheable, backends * PIPELINE_DEPTH if progressive else count)
+
+    #Sends the requests with at most `window_size` of them in flight, and yields their images in order
+    def post_parts(self, path, requests, cacheable, window_size):
+        window = RequestWindow(window_size)
+        parts = [RequestPart(self, path, data, cacheable, index, window) for index, data in enumerate(requests)]
+
+        for part in parts:
+            part.thread.start()
+
+        completed = False
+        try:
+            for part in parts:
+                if self.cancel_requested:
+                    break
+                yield from part.results()
+
+            completed = not self.cancel_requested
+        finally:
+            window.stop()
+
+            #Parts left behind by a failure finish on their own, their threads are daemons
+            if completed:
+                for part in parts:
+                    part.thread.join()
+            elif self.cancel_requested:
+                self.interrupt_parts(parts)
+
+    #The WebUI clears its interrupt flag whenever it starts a request, so the parts queued behind the interrupted
+    #one would still run. They are interrupted until they return, or given up on after CANCEL_TIMEOUT.
+    def interrupt_parts(self, parts):
+        deadline = time.time() + CANCEL_TIMEOUT
+        running = [part for part in parts if part.thread.is_alive()]
+
+        while running and time.time() < deadline:
+            for backend in set(self.backends):
+                try:
+                    interrupt(backend.base_url)
+                except OSError:
+                    pass
+
+            running[0].thread.join(CANCEL_INTERVAL)
+            running = [part for part in running if part.thread.is_alive()]
+
+#Requests queued on every backend by progressive jobs, the WebUI starts the next one as soon as the first is done
+PIPELINE_DEPTH = 2
+
+#Seconds between the interrupts sent to the parts of a cancelled job, and until the remaining ones are given up on
+CANCEL_INTERVAL = 0.25
+CANCEL_TIMEOUT = 10
+
+#Lets the part at `index` start once all but `size` of the parts before it are finished
+class RequestWindow:
+
+    def __init__(self, size):
+        self.size = size
+        self.finished = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def wait(self, index, job):
+        with self.condition:
+            while index >= self.finished + self.size and not self.stopped and not job.cancel_requested:
+                self.condition.wait(0.5)
+
+            return not self.stopped and not job.cancel_requested
+
+    def release(self):
+        with self.condition:
+            self.finished += 1
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+class RequestPart:
+
+    def __init__(self, job, path, data, cacheable, index, window):
+        self.job = job
+        self.path = path
+        self.data = data
+        self.cacheable = cacheable
+        self.index = index
+        self.window = window
+        self.images = deque()
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        try:
+            if self.window.wait(self.index, self.job):
+                with self.job.trace.bound():
+                    for image in self.job.post(self.path, self.data, "images", self.cacheable):
+                        with self.condition:
+                            self.images.append(image)
+                            self.condition.notify()
+        except Exception as error:
+            self.error = error
+        finally:
+            self.window.release()
+            with self.condition:
+                self.done = True
+                self.condition.notify()
+
+    def results(self):
+        while True:
+            with self.condition:
+                #A cancelled job stops waiting, its parts still queued on the backend are interrupted
+                while not self.images and not self.done and not self.job.cancel_requested:
+                    self.condition.wait(CANCEL_INTERVAL)
+
+                if not self.images:
+                    break
+                image = self.images.popleft()
+
+            yield image
+
+        if self.error is not None:
+            raise self.error
+
+#Runs one request per tile with bounded parallelism. Tile requests are fed by the main thread, which exports
+#a tile only while fewer than `concurrency` tiles are in flight, and yields (index, image) pairs.
+class TiledJob(Job):
+
+    def __init__(self, label, path, key, tile_count, concurrency, defaults = {}):
+        super().__init__(label, None)
+        self.path = path
+        self.key = key
+        self.defaults = defaults
+        self.tile_count = tile_count
+        self.concurrency = concurrency
+
+        self.inputs = deque()
+        self.fed = 0
+        self.in_flight = 0
+        self.failure = None
+        self.condition = threading.Condition()
+
+    def wants_input(self):
+        with self.condition:
+            return self.fed < self.tile_count and self.in_flight < self.concurrency \
+                and not self.cancel_requested and self.failure is None and not self.is_finished()
+
+    def feed(self, index, data):
+        with self.condition:
+            self.inputs.append((index, data))
+            self.fed += 1
+            self.in_flight += 1
+            self.condition.notify()
+
+    #Called once the tile result has been stitched and its memory released
+    def release_tile(self):
+        with self.condition:
+            self.in_flight -= 1
+
+    def run(self):
+        workers = [threading.Thread(target=self.work, daemon=True) for index in range(self.concurrency)]
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self.failure is not None:
+            raise self.failure
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.inputs and self.fed < self.tile_count and not self.cancel_requested and self.failure is None:
+                    self.condition.wait(0.5)
+
+                if not self.inputs or self.cancel_requested or self.failure is not None:
+                    return
+                index, data = self.inputs.popleft()
+
+            try:
+                with self.trace.bound():
+                    images = list(self.post(self.path, data | self.defaults, self.key))
+            except Exception as error:
+                with self.condition:
+                    self.failure = self.failure or error
+                    self.condition.notify_all()
+                return
+
+            self.results.append((index, images[0]))
+            self.image_count += 1
+
+def tiled_upscale_job(label, tile_count, concurrency):
+    return TiledJob(label, API_PATH + "extra-single-image", "image", tile_count, concurrency)
+
+def tiled_img_to_img_job(label, tile_count, concurrency, checkpoint = None):
+    defaults = BASE_CONFIG | {"n_iter": 1, "batch_size": 1}
+    job = TiledJob(label, API_PATH + "img2img", "images", tile_count, concurrency, defaults)
+    job.checkpoint = checkpoint
+
+    return job
+
+#Models a generation loads, the checkpoint and the refiner it switches to. Swapping them takes the WebUI seconds
+#to minutes, jobs on the same ones are grouped together.
+def job_checkpoint(data):
+    checkpoint = data.get("override_settings", {}).get("sd_model_checkpoint")
+    if checkpoint is None:
+        return None
+
+    return (checkpoint, data.get("refiner_checkpoint") if data.get("use_refiner") else None)
+
+def create_job(label, path, data: dict, key):
+    if key == "images":
+        #Grids are dropped by the plugin anyway, and cannot be merged when a batch is split between backends
+        data = data | {"override_settings": data.get("override_settings", {}) | {"return_grid": False}}
+        progressive = data.get("progressive", False)
+        job = Job(label, lambda job: job.post_split(path, data, progressive))
+        job.checkpoint = job_checkpoint(data)
+
+        return job
+
+    return Job(label, lambda job: job.post(path, data, key))
+
+#One job for all the requests of a parameter sweep, pipelined like progressive batches
+def sweep_job(label, path, requests):
+    requests = [data | {"override_settings": data.get("override_settings", {}) | {"return_grid": False}} for data in requests]
+
+    def post(job):
+        backend_pool.refresh()
+        return job.post_parts(path, requests, None, len(backend_pool.healthy()) * PIPELINE_DEPTH)
+
+    job = Job(label, post)
+    job.checkpoint = job_checkpoint(requests[0])
+
+    return job
+
+def txt_to_img_job(label, config_data):
+    return create_job(label, API_PATH + "txt2img", config_data | BASE_CONFIG, "images")
+
+def img_to_img_job(label, config_data):
+    return create_job(label, API_PATH + "img2img", config_data | BASE_CONFIG, "images")
+
+def upscale_job(label, config_data):
+    return create_job(label, API_PATH + "extra-single-image", config_data, "image")
+
+def remove_bg_job(label, config_data):
+    return create_job(label, "rembg", config_data, "image")
+
+#Times a queued job may be passed over by jobs on an already loaded checkpoint
+SCHEDULER_MAX_SKIPS = 3
+
+#Runs submitted jobs with as many running at once as there are backends, each WebUI only processes one request
+#at a time. Jobs are started in order, except that those needing no checkpoint swap go first.
+class JobQueue:
+
+    def __init__(self, workers):
+        self.pending = deque()
+        self.jobs = []
+        self.running = []
+        self.workers = []
+        self.worker_count = workers
+        self.condition = threading.Condition()
+
+        self.first_started_at = None
+        self.finished_images = 0
+
+    def submit(self, job):
+        with self.condition:
+            self.pending.append(job)
+            self.jobs.append(job)
+
+            if not self.workers:
+                for index in range(self.worker_count):
+                    worker = threading.Thread(target=self.work, name="sd-jobs-%d" % index, daemon=True)
+                    worker.start()
+                    self.workers.append(worker)
+
+            self.condition.notify()
 
-def get_controlnet_modules():
-    return get_request("controlnet/module_list", SD_BASE_URL)["module_list"]
+        return job
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
 
-def get_current_model():
-    return get_request("options")["sd_model_checkpoint"]
+                job = self.next_job()
+                job.status = Job.RUNNING
+                job.started_at = time.time()
+                self.running.append(job)
+                self.first_started_at = self.first_started_at or job.started_at
+
+            try:
+                job.run()
+                status = Job.CANCELLED if job.cancel_requested else Job.DONE
+            except Exception as error:
+                job.error = str(error)
+                status = Job.CANCELLED if job.cancel_requested else Job.FAILED
+
+            with self.condition:
+                job.status = status
+                job.finished_at = time.time()
+                self.finished_images += job.image_count
+                self.running.remove(job)
+                self.condition.notify_all()
+
+    #The first job that runs on a checkpoint a backend has loaded, or needs none, unless a job before it
+    #was already passed over too often. Called with the condition held.
+    def next_job(self):
+        loaded = {backend.checkpoint for backend in backend_pool.backends}
+        chosen = self.pending[0]
+
+        for job in self.pending:
+            if job.skipped >= SCHEDULER_MAX_SKIPS or job.checkpoint is None or job.checkpoint in loaded:
+                chosen = job
+                break
+
+        for job in self.pending:
+            if job is chosen:
+                break
+            job.skipped += 1
+
+        self.pending.remove(chosen)
+        return chosen
+
+    def cancel(self, job):
+        with self.condition:
+            if job.status == Job.QUEUED:
+                self.pending.remove(job)
+                job.status = Job.CANCELLED
+                return
+
+            if job not in self.running:
+                return
+
+            job.cancel_requested = True
+
+        send_to_backends(interrupt, {backend.base_url for backend in job.backends})
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            self.cancel(job)
+
+    def skip(self):
+        send_to_backends(skip, {backend.base_url for job in list(self.running) for backend in job.backends})
+
+    def depth(self):
+        with self.condition:
+            return len(self.pending)
+
+    def is_idle(self):
+        with self.condition:
+            return not self.pending and not self.running
+
+    #Images per minute since the first job started
+    def throughput(self):
+        if self.first_started_at is None:
+            return 0
+
+        return self.finished_images * 60 / max(time.time() - self.first_started_at, 1e-3)
+
+job_queue = JobQueue(len(backend_pool))
+
+#Loads the checkpoint chosen in the dialog on the idle backends while the user is still filling it in,
+#so that the first generation does not wait for it. The WebUI keeps it as its selected checkpoint.
+PREWARM_TIMEOUT = 600
+
+#Loads run one at a time
+prewarm_lock = threading.Lock()
+prewarm_target = None
+
+def prewarm(checkpoint):
+    global prewarm_target
+
+    prewarm_target = checkpoint
+    threading.Thread(target=load_checkpoint, args=(checkpoint,), name="sd-prewarm", daemon=True).start()
+
+def load_checkpoint(checkpoint):
+    with prewarm_lock:
+        #Superseded by another choice, or the backends are busy with jobs that need their current checkpoint
+        if checkpoint != prewarm_target or not job_queue.is_idle():
+            return
+
+        backend_pool.refresh()
+        for backend in backend_pool.healthy():
+            if backend.busy or backend.active or (backend.checkpoint or (None,))[0] == checkpoint:
+                continue
+
+            try:
+                session.post_json(backend.base_url + API_PATH + "options", {"sd_model_checkpoint": checkpoint}, timeout = PREWARM_TIMEOUT)
+                backend.checkpoint = (checkpoint, None)
+            except (OSError, ValueError):
+                pass
+
+#The progress of the backends with requests in flight is polled by a single thread for all jobs, and only while
+#a window shows it. Polls get further apart the longer the reported ETA is. The WebUI renders a live preview
+#for every poll that does not skip it, which takes time from the generation, so previews are only asked for
+#every PREVIEW_INTERVAL seconds.
+PROGRESS_MIN_INTERVAL = 0.25
+PROGRESS_MAX_INTERVAL = 2
+#Share of the remaining time waited before the next poll
+PROGRESS_ETA_FRACTION = 0.05
+PREVIEW_INTERVAL = 2
+#Largest side of the decoded previews, in pixels
+PREVIEW_SIZE = 256
+
+class BackendProgress:
+
+    def __init__(self):
+        self.watchers = 0
+        self.fraction = 0
+        self.eta = 0
+        self.text = ""
+        self.preview = None
+        self.preview_data = None
+        self.preview_updated_at = 0
+        self.poll_at = 0
+        self.preview_at = 0
+
+    #Nothing changes before the first step, queued or loading requests are polled at the slowest rate
+    def interval(self):
+        if self.fraction <= 0:
+            return PROGRESS_MAX_INTERVAL
+
+        return min(max(self.eta * PROGRESS_ETA_FRACTION, PROGRESS_MIN_INTERVAL), PROGRESS_MAX_INTERVAL)
+
+def decode_preview(data):
+    stream = Gio.MemoryInputStream.new_from_bytes(GLib.Bytes.new(base64.b64decode(data.split(",", 1)[-1])))
+
+    return GdkPixbuf.Pixbuf.new_from_stream_at_scale(stream, PREVIEW_SIZE, PREVIEW_SIZE, True, None)
+
+class ProgressPoller:
+
+    def __init__(self):
+        self.backends = {}
+        self.subscribers = 0
+        self.thread = None
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def watching(self, base_url):
+        with self.condition:
+            progress = self.backends.get(base_url)
+            if progress is None:
+                progress = self.backends[base_url] = BackendProgress()
+            progress.watchers += 1
+            self.condition.notify()
+
+        try:
+            yield progress
+        finally:
+            with self.condition:
+                progress.watchers -= 1
+                if not progress.watchers:
+                    del self.backends[base_url]
+
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work, name="sd-progress", daemon=True)
+                self.thread.start()
+
+            self.condition.notify()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def work(self):
+        while True:
+            with self.condition:
+                while True:
+                    now = time.time()
+                    watched = list(self.backends.items()) if self.subscribers else []
+                    due = [(base_url, progress) for base_url, progress in watched if progress.poll_at <= now]
+                    if due:
+                        break
+
+                    self.condition.wait(min(progress.poll_at for base_url, progress in watched) - now if watched else None)
+
+            for base_url, progress in due:
+                self.poll(base_url, progress)
+
+    def poll(self, base_url, progress):
+        preview = time.time() >= progress.preview_at
+        uri = "progress?skip_current_image=%s" % ("false" if preview else "true")
+
+        try:
+            progress_json = session.get_json(base_url + API_PATH + uri, timeout = BACKEND_CHECK_TIMEOUT)
+            state = progress_json["state"]
+            image = decode_preview(progress_json["current_image"]) \
+                if preview and progress_json.get("current_image") and progress_json["current_image"] != progress.preview_data else None
+        except (OSError, ValueError, KeyError, GLib.Error):
+            progress.poll_at = time.time() + PROGRESS_MAX_INTERVAL
+            return
+
+        with self.condition:
+            progress.fraction = progress_json["progress"]
+            progress.eta = max(progress_json["eta_relative"], 0)
+            progress.text = state.get("job") or ""
+            if state.get("sampling_steps"):
+                progress.text += " step %d/%d" % (state["sampling_step"], state["sampling_steps"])
+
+            if preview:
+                progress.preview_at = time.time() + PREVIEW_INTERVAL
+            if image is not None:
+                progress.preview, progress.preview_data = image, progress_json["current_image"]
+                progress.preview_updated_at = time.time()
+
+            progress.poll_at = time.time() + progress.interval()
+
+    #(fraction, ETA, text, preview) over the watched backends: the mean fraction, the longest ETA and the latest preview
+    def snapshot(self):
+        with self.condition:
+            polled = [progress for progress in self.backends.values() if progress.poll_at]
+
+            if not polled:
+                return None
+
+            latest = max(polled, key=lambda progress: progress.preview_updated_at)
+
+            return (sum(progress.fraction for progress in polled) / len(polled), max(progress.eta for progress in polled),
+                    " - ".join(progress.text for progress in polled if progress.text), latest.preview)
+
+progress_poller = ProgressPoller()
+
+class JobQueueWindow(Gtk.Window):
+
+    def __init__(self, queue, on_add, on_results):
+        super().__init__(title="Stableize jobs")
+        self.queue = queue
+        self.on_add = on_add
+        self.on_results = on_results
+        self.rows = {}
+        self.adding = False
+
+        self.set_border_width(12)
+        self.set_default_size(420, -1)
 
-def get_styles():
-    return get_request("prompt-styles")
-
-def get_request(uri, base_url = SD_API_URL):
-    with urlopen(base_url + uri) as response:
-        return json.loads(response.read())
-    
-def txt_to_img(config_data):
-    response = post_request("txt2img", config_data | BASE_CONFIG)
-    
-    return response["images"]
-
-def img_to_img(config_data):
-    response = post_request("img2img", config_data | BASE_CONFIG)
-
-    return response["images"]
-
-def upscale(config_data):
-    response = post_request("extra-single-image", config_data)
-
-    return response["image"]
+        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        self.add(vbox)
 
-def remove_bg(config_data):
-    response = post_request("rembg", config_data, SD_BASE_URL)
+        self.job_list = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        vbox.pack_start(self.job_list, True, True, 0)
 
-    return response["image"]
+        self.preview = Gtk.Image()
+        vbox.pack_start(self.preview, False, False, 0)
 
-def post_request(uri, data: dict, base_url = SD_API_URL):
-    request = Request(
-        base_url + uri,
-        data = json.dumps(data).encode(),
-        headers = {"Content-Type": "application/json"}
-    )
+        self.progress = Gtk.ProgressBar(show_text=True)
+        vbox.pack_start(self.progress, False, False, 0)
 
-    thread = threading.Thread(target=create_progress_bar)
-    thread.start()
+        self.status = Gtk.Label(xalign=0)
+        vbox.pack_start(self.status, False, False, 0)
 
-    with urlopen(request) as response:
-        thread.join()
-        return json.loads(response.read())
+        buttons = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        vbox.pack_start(buttons, False, False, 0)
 
-def create_progress_bar():
-    progress = ProgressBar()
-    progress.run()
+        for label, callback in [("Queue another", self.on_add_clicked), ("Skip image", self.on_skip_clicked), ("Cancel all", self.on_cancel_clicked)]:
+            button = Gtk.Button(label=label)
+            button.connect("clicked", callback)
+            buttons.pack_start(button, True, True, 0)
 
-class ProgressBar(Gtk.Application):
+        self.connect("delete-event", self.on_cancel_clicked)
+        self.connect("destroy", self.on_destroy)
 
-    def do_activate(self):
-        window = Gtk.ApplicationWindow(application=self)
-        window.set_title("Generation progress")
-        self.progress = Gtk.ProgressBar(show_text=True)
+    def run(self):
+        self.show_all()
+        progress_poller.subscribe()
+        self.timeout_id = GLib.timeout_add(250, self.on_timeout, None)
+        self.on_timeout(None)
+        Gtk.main()
 
-        window.set_border_width(20)
-
-        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
-        window.add(vbox)
+    def on_add_clicked(self, *args):
+        #The procedure dialog runs a nested main loop, the window must outlive it even if the queue drains meanwhile
+        self.adding = True
+        self.on_add()
+        self.adding = False
 
-        vbox.pack_start(self.progress, True, True, 0)
+    def on_destroy(self, *args):
+        progress_poller.unsubscribe()
+        Gtk.main_quit()
 
-        window.present()
-        window.show_all()
+    def on_skip_clicked(self, *args):
+        self.queue.skip()
 
-        self.timeout_id = GLib.timeout_add(100, self.on_timeout, None)
+    def on_cancel_clicked(self, *args):
+        self.queue.cancel_all()
+        return True
 
     def on_timeout(self, user_data):
-        progress_json = get_request("progress")
-        progress = progress_json["progress"]
-
-        if progress > 0:
-            self.progress.set_fraction(progress)
-            self.progress.set_text("%s - ETA: %ss" % (progress_json["state"]["job"], f"{max(progress_json["eta_relative"], 0):.2f}"))
-        
-            return True
-    
-        self.quit()
\ No newline at end of file
+        self.on_results()
+
+        for job in self.queue.jobs:
+            row = self.rows.get(job)
+            if row is None:
+                row = self.rows[job] = Gtk.Label(xalign=0)
+                self.job_list.pack_start(row, False, False, 0)
+                row.show()
+
+            row.set_text("%s - %s (%d images)" % (job.label, job.status, job.image_count))
+
+        snapshot = progress_poller.snapshot()
+        if snapshot is not None:
+            fraction, eta, text, preview = snapshot
+            self.progress.set_fraction(fraction)
+            self.progress.set_text("%s%sETA: %.1fs" % (text, " - " if text else "", eta))
+
+            if preview is not None and preview is not self.preview.get_pixbuf():
+                self.preview.set_from_pixbuf(preview)
+        else:
+            self.progress.set_fraction(0)
+            self.progress.set_text("")
+
+        cache_stats = result_cache.stats()
+        self.status.set_text("%d queued - %.1f images/min - %d cached results of %d" % (
+            self.queue.depth(), self.queue.throughput(), cache_stats["hits"], cache_stats["hits"] + cache_stats["misses"]))
+
+        if self.queue.is_idle() and not self.adding:
+            self.on_results()
+            self.destroy()
+            return False
+
+        return True
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import csv
+import gi       # type: ignore
+import os
+import time
+
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp, Gio
+
+import gimp_utils
+import sd_api
+import sd_jobs
+import sd_metadata
+
+#Runs one of the plug-in procedures over every image of a directory from GIMP's batch mode:
+#
+#   gimp -i --batch-interpreter=python-fu-eval -b "import sys; sys.path.insert(0, '<plug-in folder>'); \
+#       import sd_batch; sd_batch.run_directory('upscale', 'in', 'out', {'upscaling_resize': 4})" --quit
+#
+#Values missing from `settings` are the procedure's defaults. Up to `in_flight` images are loaded at once, so
+#exporting and saving overlap with the backend. Every file is appended to report.csv in the output directory
+#as soon as it finishes, files already reported as done are skipped when the batch is run again.
+
+BATCH_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff", ".bmp", ".xcf")
+REPORT_NAME = "report.csv"
+REPORT_FIELDS = ["file", "status", "outputs", "export_s", "queued_s", "backend_s", "save_s", "total_s", "error"]
+
+def read_report(path):
+    try:
+        with open(path, newline="") as file:
+            return {row["file"]: row for row in csv.DictReader(file)}
+    except OSError:
+        return {}
+
+def append_report(path, row):
+    exists = os.path.exists(path)
+
+    with open(path, "a", newline="") as file:
+        writer = csv.DictWriter(file, REPORT_FIELDS)
+        if not exists:
+            writer.writeheader()
+        writer.writerow(row)
+
+def create_jobs(procedure_name, image, config_data):
+    match procedure_name:
+        case 'remove-background':
+            return sd_jobs.remove_bg(procedure_name, image, config_data)
+        case 'upscale':
+            return sd_jobs.upscale(procedure_name, image, config_data)
+        case _:
+            style_list = [style['name'] for style in sd_metadata.get_styles()]
+            return sd_jobs.generation(procedure_name, image, config_data, style_list)
+
+class BatchItem:
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.image = None
+        self.job = None
+        self.batch = None
+        self.started_at = time.perf_counter()
+        self.export_time = 0
+
+    def submit(self, procedure_name, config_data):
+        self.image = Gimp.file_load(Gimp.RunMode.NONINTERACTIVE, Gio.File.new_for_path(self.path))
+        self.job, self.batch = sd_jobs.submit(*create_jobs(procedure_name, self.image, config_data))
+        self.export_time = time.perf_counter() - self.started_at
+
+    def save(self, output_dir):
+        stem = os.path.splitext(self.name)[0]
+        layers = self.batch.result_layers()
+        outputs = []
+
+        for index, layer in enumerate(layers):
+            output = "%s.png" % stem if len(layers) == 1 else "%s_%02d.png" % (stem, index + 1)
+            gimp_utils.save_layer(layer, os.path.join(output_dir, output))
+            outputs.append(output)
+
+        return outputs
+
+    def report(self, output_dir):
+        job = self.job
+        row = {
+            "file": self.name,
+            "status": job.status,
+            "export_s": "%.3f" % self.export_time,
+            "queued_s": "%.3f" % ((job.started_at or job.finished_at) - job.submitted_at),
+            "backend_s": "%.3f" % (job.finished_at - job.started_at) if job.started_at else "",
+            "error": job.error or "",
+        }
+
+        save_started_at = time.perf_counter()
+        try:
+            if job.status == sd_api.Job.DONE:
+                row["outputs"] = " ".join(self.save(output_dir))
+        except Exception as error:
+            row["status"], row["error"] = sd_api.Job.FAILED, str(error)
+        finally:
+            self.batch.close()
+            self.image.delete()
+
+        row["save_s"] = "%.3f" % (time.perf_counter() - save_started_at)
+        row["total_s"] = "%.3f" % (time.perf_counter() - self.started_at)
+
+        return row
+
+def run_directory(procedure_name, input_dir, output_dir, settings = {}, in_flight = 2):
+    sd_metadata.update_metadata()
+    procedure = Gimp.get_pdb().lookup_procedure(procedure_name)
+    config_data = sd_jobs.get_config(procedure.create_config()) | settings
+
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = os.path.join(output_dir, REPORT_NAME)
+    done = {name for name, row in read_report(report_path).items() if row["status"] == sd_api.Job.DONE}
+
+    names = [name for name in sorted(os.listdir(input_dir))
+             if name.lower().endswith(BATCH_EXTENSIONS) and name not in done]
+    active = []
+    summary = {}
+
+    while names or active:
+        while names and len(active) < in_flight:
+            name = names.pop(0)
+            item = BatchItem(name, os.path.join(input_dir, name))
+
+            try:
+                item.submit(procedure_name, config_data)
+                active.append(item)
+            except Exception as error:
+                if item.image is not None:
+                    item.image.delete()
+                append_report(report_path, {"file": item.name, "status": sd_api.Job.FAILED, "error": str(error)})
+                summary[sd_api.Job.FAILED] = summary.get(sd_api.Job.FAILED, 0) + 1
+
+        sd_jobs.insert_results([(item.job, item.batch) for item in active])
+
+        for item in [item for item in active if item.job.is_finished()]:
+            sd_jobs.insert_results([(item.job, item.batch)])
+            row = item.report(output_dir)
+            append_report(report_path, row)
+            summary[row["status"]] = summary.get(row["status"], 0) + 1
+            active.remove(item)
+
+        time.sleep(0.05)
+
+    return summary
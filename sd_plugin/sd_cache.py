@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+from collections import OrderedDict
+import os
+import threading
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/.cache"),
+    "gimp_stableize"
+)
+
+class LRUCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    #Does not count as a hit or a miss, nor refresh the entry
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+
+            self.counters["hits"] += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+#One file per key, the least recently used files are deleted once the directory grows over max_bytes
+class DiskCache:
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as file:
+                data = file.read()
+        except OSError:
+            self.count("misses")
+            return None
+
+        self.count("hits")
+
+        #The modification time doubles as last access time for eviction
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = "%s.%d.tmp" % (self.path(key), os.getpid())
+
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, self.path(key))
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        size = 0
+
+        with os.scandir(self.directory) as files:
+            for file in files:
+                if file.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, file.path))
+                size += stat.st_size
+
+        for mtime, file_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+                size -= file_size
+            except OSError:
+                pass
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+from contextlib import contextmanager
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+import gzip
+import http.client
+import io
+import json
+import re
+import select
+import threading
+import time
+import zlib
+
+import sd_trace
+
+#Errors raised by a kept-alive connection the server already closed
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+#`read_timeout` waiting for the response as long as the server takes, e.g. for a generation that only answers once done
+UNBOUNDED = float("inf")
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+#Smaller bodies are not worth compressing
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 1
+WHITESPACE = b" \t\r\n,"
+
+#Yields the strings of the top level array `key` of a JSON response while it is being received,
+#holding at most one element plus one chunk in memory
+def iter_json_strings(response, key):
+    pattern = re.compile(rb'"' + re.escape(key.encode()) + rb'"\s*:\s*\[')
+    buffer = bytearray()
+
+    while True:
+        match = pattern.search(buffer)
+        if match:
+            del buffer[:match.end()]
+            break
+
+        chunk = response.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            return
+
+        #Keep enough of the tail for a key split across two chunks
+        del buffer[:max(len(buffer) - len(key) - 64, 0)]
+        buffer += chunk
+
+    position = 0
+    while True:
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+
+        if position < len(buffer):
+            if buffer[position] == ord("]"):
+                break
+
+            end = buffer.find(b'"', position + 1)
+            while end != -1 and is_quote_escaped(buffer, end, position):
+                end = buffer.find(b'"', end + 1)
+
+            if end != -1:
+                token = bytes(buffer[position + 1:end])
+                del buffer[:end + 1]
+                position = 0
+
+                yield json.loads(b'"' + token + b'"') if b"\\" in token else token.decode()
+                continue
+
+        chunk = response.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("Truncated JSON array '%s'" % key)
+
+        del buffer[:position]
+        position = 0
+        buffer += chunk
+
+    #Drain the rest of the body so the connection can be reused
+    while response.read(STREAM_CHUNK_SIZE):
+        pass
+
+#An idle connection the server closed reads as ready, with its end of file
+def is_dropped(connection):
+    if connection.sock is None:
+        return True
+
+    readable, writable, errors = select.select([connection.sock], [], [], 0)
+    return bool(readable)
+
+#Transfer time the uncompressed body would have taken at the rate measured for the compressed one
+def saved_time(raw_size, size, seconds):
+    return (raw_size - size) * seconds / max(size, 1)
+
+def is_quote_escaped(buffer, index, start):
+    count = 0
+    while index - count - 1 > start and buffer[index - count - 1] == ord("\\"):
+        count += 1
+
+    return count % 2 == 1
+
+#Decompresses a gzip encoded response while it is read, read(size) may return more than `size` bytes
+class GzipReader:
+
+    def __init__(self, response):
+        self.response = response
+        self.status = response.status
+        self.headers = response.headers
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.size = 0
+
+    def read(self, size = -1):
+        while True:
+            chunk = self.response.read(size) if size is not None and size >= 0 else self.response.read()
+            data = self.decompressor.decompress(chunk) if chunk else self.decompressor.flush()
+
+            if data or not chunk:
+                self.size += len(data)
+                return data
+
+class Response:
+
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+    def json(self):
+        return json.loads(self.data)
+
+class Session:
+
+    #`accept_gzip` asks for compressed responses, `gzip_requests` compresses the bodies sent, which only works
+    #behind a server or proxy decoding them
+    def __init__(self, timeout = None, retries = 2, retry_backoff = 0.2, max_idle = 4, accept_gzip = False, gzip_requests = False):
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_idle = max_idle
+        self.accept_gzip = accept_gzip
+        self.gzip_requests = gzip_requests
+
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.counters = {
+            "requests": 0,
+            "connections_opened": 0,
+            "connections_reused": 0,
+            "retries": 0,
+            "bytes_sent": 0,
+            "bytes_received": 0
+        }
+
+    def count(self, name, value = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def acquire(self, key, timeout):
+        with self.lock:
+            connections = self.idle.get(key, [])
+            while connections:
+                connection = connections.pop()
+                if is_dropped(connection):
+                    connection.close()
+                    continue
+
+                self.counters["connections_reused"] += 1
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+
+            self.counters["connections_opened"] += 1
+
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+
+        return connection_class(host, port, timeout = timeout), False
+
+    def release(self, key, connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    #A request sent in full may have reached the backend and is not replayed, it could start a second generation
+    def should_retry(self, method, error, sent, attempt):
+        if attempt >= self.retries:
+            return False
+
+        return not sent or method in IDEMPOTENT_METHODS
+
+    #`timeout` applies to connecting and sending, and to the response unless `read_timeout` is given
+    @contextmanager
+    def open(self, method, url, body = None, headers = {}, timeout = None, read_timeout = None):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        timeout = self.timeout if timeout is None else timeout
+
+        self.count("requests")
+
+        raw_size = len(body) if body else 0
+        compress_time = 0
+        if self.accept_gzip:
+            headers = headers | {"Accept-Encoding": "gzip"}
+        if self.gzip_requests and raw_size >= GZIP_MIN_BYTES:
+            with sd_trace.span("compress", bytes=raw_size):
+                started = time.perf_counter()
+                body = gzip.compress(body, GZIP_LEVEL)
+                compress_time = time.perf_counter() - started
+            headers = headers | {"Content-Encoding": "gzip"}
+
+        attempt = 0
+        while True:
+            connection, reused = self.acquire(key, timeout)
+            sent = False
+            try:
+                with sd_trace.span("upload", bytes=len(body) if body else 0, reused=reused) as span:
+                    started = time.perf_counter()
+                    connection.request(method, path, body, headers)
+                    sent = True
+                    if read_timeout is not None:
+                        connection.sock.settimeout(None if read_timeout == UNBOUNDED else read_timeout)
+                    if raw_size > len(body or b""):
+                        span["raw"] = raw_size
+                        span["saved_s"] = saved_time(raw_size, len(body), time.perf_counter() - started) - compress_time
+                with sd_trace.span("backend"):
+                    response = connection.getresponse()
+                break
+            except (http.client.HTTPException, OSError) as error:
+                connection.close()
+                if not self.should_retry(method, error, sent, attempt):
+                    raise
+
+                self.count("retries")
+                #A stale kept-alive connection is not an attempt, the next one may be stale too
+                if not (reused and isinstance(error, STALE_CONNECTION_ERRORS)):
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+                    attempt += 1
+
+        try:
+            if response.status >= 400:
+                raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(response.read()))
+
+            size = int(response.getheader("Content-Length") or 0)
+            reader = GzipReader(response) if response.getheader("Content-Encoding") == "gzip" else response
+            self.count("bytes_sent", len(body) if body else 0)
+            self.count("bytes_received", size)
+
+            with sd_trace.span("download", bytes=size) as span:
+                started = time.perf_counter()
+                yield reader
+
+                if reader is not response and size:
+                    span["raw"] = reader.size
+                    span["saved_s"] = saved_time(reader.size, size, time.perf_counter() - started)
+        finally:
+            #Only a fully read response leaves the connection usable for the next request
+            if response.isclosed() and not response.will_close:
+                self.release(key, connection)
+            else:
+                connection.close()
+
+    def request(self, method, url, body = None, headers = {}, timeout = None, read_timeout = None):
+        with self.open(method, url, body, headers, timeout, read_timeout) as response:
+            return Response(response.status, response.headers, response.read())
+
+    def get_json(self, url, timeout = None):
+        return self.request("GET", url, timeout = timeout).json()
+
+    def post_json_stream(self, url, data, key, timeout = None, read_timeout = None):
+        with sd_trace.span("build"):
+            body = json.dumps(data).encode()
+
+        with self.open("POST", url, body, {"Content-Type": "application/json"}, timeout, read_timeout) as response:
+            yield from iter_json_strings(response, key)
+
+    def post_json(self, url, data, timeout = None, read_timeout = None):
+        with sd_trace.span("build"):
+            body = json.dumps(data).encode()
+
+        response = self.request("POST", url, body, {"Content-Type": "application/json"}, timeout, read_timeout)
+
+        with sd_trace.span("parse"):
+            return response.json()
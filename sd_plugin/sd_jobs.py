@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+from functools import wraps
+import gi       # type: ignore
+import random
+import time
+
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+
+import gimp_utils
+import sd_api
+import sd_sweep
+import sd_trace
+
+#Builds backend jobs from a GIMP image and the procedure's values, shared by the plug-in dialogs and the batch driver.
+#Every builder returns the job and the batch its results are inserted with.
+
+def get_config(config):
+    config_data = {}
+
+    for property in dir(config.props):
+        if property != 'procedure':
+            config_data[property] = config.get_property(property)
+
+    return config_data
+
+#Records the export done while building in the trace of the job. The image is not edited while building, the
+#exports share their fingerprints.
+def traced(builder):
+    @wraps(builder)
+    def build(name, *args):
+        trace = sd_trace.start(name)
+
+        with trace.bound(), gimp_utils.reused_fingerprints():
+            job, batch = builder(name, *args)
+
+        job.trace = trace
+
+        return job, batch
+
+    return build
+
+@traced
+def remove_bg(name, image, config_data):
+    config_data = config_data | {"input_image": gimp_utils.get_image_as_base64(image)}
+
+    return sd_api.remove_bg_job(name, config_data), gimp_utils.LayerBatch(image)
+
+@traced
+def upscale(name, image, config_data):
+    label = "%s x%g" % (name, config_data['upscaling_resize'])
+
+    if config_data['use_tiling']:
+        selection_pos = Gimp.Selection.bounds(image)
+        batch = gimp_utils.TiledBatch(image, (0, 0, image.get_width(), image.get_height()), (selection_pos.x1, selection_pos.y1),
+                                      config_data['upscaling_resize'], config_data['tile_size'], config_data['tile_overlap'],
+                                      lambda tile, width, height: config_data | {"image": tile})
+
+        return sd_api.tiled_upscale_job(label, len(batch.tiles), config_data['tile_concurrency']), batch
+
+    config_data = config_data | {"image": gimp_utils.get_image_as_base64(image)}
+
+    return sd_api.upscale_job(label, config_data), gimp_utils.LayerBatch(image)
+
+@traced
+def generation(name, image, config_data, style_list):
+    started = time.perf_counter()
+    styles = []
+    for style in style_list:
+        if config_data.get(style):
+            styles.append(style)
+
+    success, non_empty, x1, y1, x2, y2 = Gimp.Selection.bounds(image)
+    roi = generation_roi(name, image, config_data)
+
+    config_data = config_data | {
+        "width": roi[2] if roi else abs(x1 - x2) if non_empty else image.get_width(),
+        "height": roi[3] if roi else abs(y1 - y2) if non_empty else image.get_height(),
+        "styles": styles,
+        "override_settings": {"sd_model_checkpoint": config_data['model']} if config_data['model'] else {},
+    }
+
+    tiled = is_tiled(name, config_data)
+
+    if config_data['use_control_net']:
+        config_data['alwayson_scripts'] = {
+            "controlnet": {
+                "args": [
+                    {
+                        "enabled": True,
+                        "image": None if tiled else gimp_utils.get_image_as_base64(image, roi, gimp_utils.HINT_FORMAT),
+                        "model": config_data['controlnet_model'],
+                        "module": config_data['controlnet_module'],
+                        "weight": config_data['controlnet_weight'],
+                        "guidance_start": config_data['controlnet_start'],
+                        "guidance_end": config_data['controlnet_stop']
+                    }
+                ]
+            }
+        }
+
+    label = "%s: %s" % (name, config_data['prompt'][:40])
+
+    if tiled:
+        return tiled_generation(image, config_data, label)
+
+    if name == 'image-to-image':
+        inpainting_mask = config_data['mask']
+
+        if inpainting_mask:
+            config_data['mask'] = gimp_utils.get_mask_as_base64(image, inpainting_mask, roi)
+
+        config_data["init_images"] = [gimp_utils.get_image_as_base64(image, roi, gimp_utils.UPLOAD_FORMAT, inpainting_mask)]
+
+    if config_data.get('use_sweep'):
+        return sweep_generation(name, image, config_data, label, roi, time.perf_counter() - started)
+
+    match name:
+        case 'text-to-image':
+            job = sd_api.txt_to_img_job(label, config_data)
+        case 'image-to-image':
+            job = sd_api.img_to_img_job(label, config_data)
+
+    image_count = config_data['n_iter'] * config_data['batch_size']
+
+    return job, gimp_utils.LayerBatch(image, group = image_count > 1, roi = roi)
+
+def generation_roi(name, image, config_data):
+    #Text-to-image only uploads the ControlNet hint, without one the result is placed like any other
+    if not config_data['selection_only'] or (name == 'text-to-image' and not config_data['use_control_net']):
+        return None
+
+    margin = 0
+    if name == 'image-to-image':
+        margin = config_data['context_margin']
+
+        #Only masked inpainting crops around the mask with this padding on the backend side
+        if config_data['use_inpainting'] and config_data['inpaint_full_res']:
+            margin = max(margin, int(config_data['inpaint_full_res_padding']))
+
+    return gimp_utils.get_roi(image, margin)
+
+#Tiled image-to-image exports the input and the ControlNet hint per tile
+def is_tiled(name, config_data):
+    return name == 'image-to-image' and config_data['use_tiling'] and not config_data['mask'] and not config_data.get('use_sweep')
+
+#Every variant of a sweep is sent with the input and hint exported above, as a single job
+def sweep_generation(name, image, config_data, label, roi, export_time):
+    #A random seed is drawn once, so that the variants only differ by the swept parameters
+    seed = config_data['seed'] if config_data['seed'] != -1 else random.randrange(4294967294)
+    requests, columns = sd_sweep.plan_requests(config_data, seed)
+    labels = [image_label for data, image_labels in requests for image_label in image_labels]
+
+    path = sd_api.API_PATH + ("txt2img" if name == 'text-to-image' else "img2img")
+    job = sd_api.sweep_job("%s (%d variants)" % (label, len(labels)), path, [config_data | sd_api.BASE_CONFIG | data for data, image_labels in requests])
+    batch = gimp_utils.SweepBatch(image, labels, columns, config_data['sweep_layout'] == 'grid', roi,
+                                  lambda: sweep_report(job, len(labels), len(requests), export_time))
+
+    return job, batch
+
+#Running the variants one by one would export the input for each of them, and send as many requests without
+#batching the seeds, so the backend time of the sweep is a lower bound of theirs
+def sweep_report(job, variant_count, request_count, export_time):
+    if job.status != sd_api.Job.DONE:
+        return None
+
+    backend_time = job.finished_at - job.started_at
+
+    return "Sweep of %d variants in %d requests: %.1fs (export %.2fs, backend %.1fs). One by one: %d exports and %d requests, at least %.1fs." % (
+        variant_count, request_count, export_time + job.finished_at - job.submitted_at, export_time, backend_time,
+        variant_count, variant_count, export_time * variant_count + backend_time)
+
+#The exports the builders above will do with these values, in the form gimp_utils.SpeculativeExport takes.
+#Tiles are exported as the job runs and are left out.
+def planned_exports(name, image, config_data):
+    match name:
+        case 'remove-background':
+            return [("image", None, gimp_utils.UPLOAD_FORMAT, None)]
+        case 'upscale':
+            return [] if config_data['use_tiling'] else [("image", None, gimp_utils.UPLOAD_FORMAT, None)]
+
+    if is_tiled(name, config_data):
+        return []
+
+    roi = generation_roi(name, image, config_data)
+    exports = []
+
+    if name == 'image-to-image':
+        if config_data['mask']:
+            exports.append(("mask", config_data['mask'], roi))
+        exports.append(("image", roi, gimp_utils.UPLOAD_FORMAT, config_data['mask']))
+
+    if config_data['use_control_net']:
+        exports.append(("image", roi, gimp_utils.HINT_FORMAT, None))
+
+    return exports
+
+#Starts exporting while the dialog of the procedure is open, cancel it once the dialog closes
+def speculate(name, image, config):
+    return gimp_utils.SpeculativeExport(image, config, lambda config: planned_exports(name, image, get_config(config)))
+
+#One image per tile of the selection (or canvas), with the ControlNet hint cut from the same tile
+def tiled_generation(image, config_data, label):
+    success, non_empty, x1, y1, x2, y2 = Gimp.Selection.bounds(image)
+    region = (x1, y1, x2 - x1, y2 - y1) if non_empty else (0, 0, image.get_width(), image.get_height())
+
+    def request(tile, width, height):
+        tile_data = config_data | {"init_images": [tile], "width": width, "height": height}
+
+        if config_data['use_control_net']:
+            controlnet = config_data['alwayson_scripts']['controlnet']['args'][0] | {"image": tile}
+            tile_data['alwayson_scripts'] = {"controlnet": {"args": [controlnet]}}
+
+        return tile_data
+
+    batch = gimp_utils.TiledBatch(image, region, region[:2], 1, config_data['tile_size'], config_data['tile_overlap'], request)
+
+    return sd_api.tiled_img_to_img_job(label, len(batch.tiles), config_data['tile_concurrency'], sd_api.job_checkpoint(config_data)), batch
+
+def submit(job, batch):
+    sd_api.job_queue.submit(job)
+    gimp_utils.write_exports()
+
+    with job.trace.bound():
+        batch.feed(job)
+
+    return job, batch
+
+#Inserts what the jobs returned so far, must run on the main thread
+def insert_results(jobs):
+    for job, batch in jobs:
+        finished = job.is_finished()
+
+        with job.trace.bound():
+            results = job.take_results()
+            for result in results:
+                batch.add(result)
+
+            #Tiled jobs get their next tiles once finished ones are stitched
+            batch.feed(job)
+
+            if finished:
+                batch.finish()
+
+            if results or finished:
+                Gimp.displays_flush()
+
+        if finished:
+            job.trace.finish(job.label, job.status, job.submitted_at, (job.started_at or job.finished_at) - job.submitted_at)
+
+#Non-interactive counterpart of the job queue window
+def wait(jobs, interval = 0.05):
+    while not all(job.is_finished() for job, batch in jobs):
+        insert_results(jobs)
+        time.sleep(interval)
+
+    insert_results(jobs)
+
+def close(jobs):
+    for job, batch in jobs:
+        batch.close()
+
+def first_error(jobs):
+    for job, batch in jobs:
+        if job.status == sd_api.Job.FAILED:
+            return job.error
+
+    return None
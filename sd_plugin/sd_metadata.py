@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+from concurrent.futures import Future, wait
+import hashlib
+import json
+import os
+import threading
+import time
+
+import sd_cache
+import sd_http
+
+#Lists of the WebUI the procedures are registered with, cached on disk. GIMP queries the plug-in on startup,
+#so this module only needs the standard library, unlike sd_api which loads GTK.
+
+#Comma separated WebUI instances, requests are balanced between them. The first one serves the metadata.
+SD_BASE_URLS = [url.rstrip("/") + "/" for url in os.environ.get("SD_PLUGIN_BACKENDS", "http://127.0.0.1:7860/").split(",") if url.strip()]
+SD_BASE_URL = SD_BASE_URLS[0]
+API_PATH = "sdapi/v1/"
+SD_API_URL = SD_BASE_URL + API_PATH
+
+#Seconds before a cached endpoint is revalidated against the WebUI
+METADATA_TTL = {
+    "options": 60,
+    "sd-models": 300,
+    "prompt-styles": 300,
+    "controlnet/model_list": 300,
+}
+METADATA_DEFAULT_TTL = 3600
+
+#Timeout of a single metadata fetch, and how long opening a dialog or registering without a cache may wait for the WebUI
+METADATA_FETCH_TIMEOUT = 5
+METADATA_COLD_TIMEOUT = 2
+
+session = sd_http.Session(timeout = METADATA_FETCH_TIMEOUT)
+
+class MetadataCache:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = {}
+        #Set while GIMP queries the procedures at startup, the cache is then only read
+        self.offline = False
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+
+        with self.lock:
+            with open(temp_path, "w") as file:
+                json.dump(self.entries, file)
+            os.replace(temp_path, self.path)
+
+    #Nothing was ever saved, the lists would all be empty
+    def is_cold(self):
+        return not os.path.exists(self.path)
+
+    def is_fresh(self, uri, entry):
+        return time.time() - entry["fetched_at"] < METADATA_TTL.get(uri, METADATA_DEFAULT_TTL)
+
+    def refresh(self, uri, base_url):
+        key = base_url + uri
+
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = Future()
+                self.pending[key] = future
+                #A daemon thread, a fetch still waiting for the backend does not keep the plug-in alive once it returns
+                threading.Thread(target=self.run_fetch, args=(future, uri, base_url), name="sd-metadata", daemon=True).start()
+
+        return future
+
+    def run_fetch(self, future, uri, base_url):
+        try:
+            future.set_result(self.fetch(uri, base_url))
+        except Exception as error:
+            future.set_exception(error)
+
+    def fetch(self, uri, base_url):
+        key = base_url + uri
+        entry = self.entries.get(key)
+        headers = {"If-None-Match": entry["etag"]} if entry and entry.get("etag") else {}
+
+        try:
+            response = session.request("GET", base_url + uri, headers = headers, timeout = METADATA_FETCH_TIMEOUT)
+
+            if response.status == 304 and entry is not None:
+                entry = entry | {"fetched_at": time.time()}
+            else:
+                entry = {
+                    "data": response.json(),
+                    "etag": response.headers.get("ETag"),
+                    "fetched_at": time.time()
+                }
+        except (OSError, ValueError):
+            #Backend unreachable, keep serving the stale entry
+            return self.release(key)
+
+        with self.lock:
+            self.entries[key] = entry
+
+        self.save()
+        self.release(key)
+
+    def release(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+    #Fetches the missing and outdated entries, and returns their futures
+    def prefetch(self, endpoints):
+        futures = []
+
+        for uri, base_url in endpoints:
+            entry = self.entries.get(base_url + uri)
+            if entry is None or not self.is_fresh(uri, entry):
+                futures.append(self.refresh(uri, base_url))
+
+        return futures
+
+    #Never waits for the WebUI, outdated or missing entries are fetched in the background for the next call
+    def get(self, uri, base_url = SD_API_URL, default = None):
+        entry = self.entries.get(base_url + uri)
+
+        if not self.offline and (entry is None or not self.is_fresh(uri, entry)):
+            self.refresh(uri, base_url)
+
+        return entry["data"] if entry is not None else default
+
+metadata_cache = MetadataCache(os.path.join(sd_cache.CACHE_DIR, "metadata.json"))
+
+METADATA_ENDPOINTS = [
+    ("prompt-styles", SD_API_URL),
+    ("sd-models", SD_API_URL),
+    ("options", SD_API_URL),
+    ("samplers", SD_API_URL),
+    ("schedulers", SD_API_URL),
+    ("upscalers", SD_API_URL),
+    ("latent-upscale-modes", SD_API_URL),
+    ("controlnet/model_list", SD_BASE_URL),
+    ("controlnet/module_list", SD_BASE_URL),
+]
+
+def prefetch_metadata():
+    metadata_cache.prefetch(METADATA_ENDPOINTS)
+
+#Brings the cache up to date before the lists are used, waiting `timeout` seconds at most for the WebUI
+def update_metadata(timeout = METADATA_COLD_TIMEOUT):
+    wait(metadata_cache.prefetch(METADATA_ENDPOINTS), timeout = timeout)
+
+def get_cached_request(uri, base_url = SD_API_URL, default = None):
+    return metadata_cache.get(uri, base_url, default)
+
+def get_list_from_api(uri, param_name):
+    list = []
+
+    for element in get_cached_request(uri, default = []):
+        list.append(element[param_name])
+
+    return list
+
+def get_models():
+    return get_list_from_api("sd-models", "title")
+
+def get_upscaler_models():
+    return get_list_from_api("upscalers", "name")
+
+def get_latent_upscale_modes():
+    return get_list_from_api("latent-upscale-modes", "name")
+
+def get_samplers():
+    return get_list_from_api("samplers", "name")
+
+def get_schedulers():
+    return get_list_from_api("schedulers", "label")
+
+def get_rembg_models():
+    #Hardcoded in base module, not accessible by API
+    return [    
+        "None",
+        "isnet-general-use",
+        "isnet-anime",
+        "u2net",
+        "u2netp",
+        "u2net_human_seg",
+        "u2net_cloth_seg",
+        "silueta"
+    ]
+
+def get_controlnet_models():
+    return get_cached_request("controlnet/model_list", SD_BASE_URL, {}).get("model_list", [])
+
+def get_controlnet_modules():
+    return get_cached_request("controlnet/module_list", SD_BASE_URL, {}).get("module_list", [])
+
+def get_current_model():
+    return get_cached_request("options", default = {}).get("sd_model_checkpoint", "")
+
+def get_styles():
+    return get_cached_request("prompt-styles", default = [])
+
+#GIMP keeps the registered procedures in its pluginrc and only queries the plug-in again once its file changed.
+#The digest of the lists they were registered with tells whether they are outdated.
+REGISTRATION_PATH = os.path.join(sd_cache.CACHE_DIR, "registration.json")
+
+def registration_digest():
+    lists = [get_models(), get_samplers(), get_schedulers(), get_upscaler_models(), get_latent_upscale_modes(),
+             get_controlnet_models(), get_controlnet_modules(), get_styles()]
+
+    return hashlib.sha1(json.dumps(lists, sort_keys=True).encode()).hexdigest()
+
+def save_registration():
+    try:
+        os.makedirs(os.path.dirname(REGISTRATION_PATH), exist_ok=True)
+        with open(REGISTRATION_PATH, "w") as file:
+            json.dump({"digest": registration_digest()}, file)
+    except OSError:
+        pass
+
+#Only a saved digest that differs counts, without one there is nothing to compare with
+def is_registration_outdated():
+    try:
+        with open(REGISTRATION_PATH) as file:
+            digest = json.load(file)["digest"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+    return digest != registration_digest()
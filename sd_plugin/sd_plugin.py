@@ -1,23 +1,45 @@
 #!/usr/bin/env python3
 import gi       # type: ignore
+import os
 import sys
 
-import gimp_utils
-import sd_api
+import sd_metadata
 
 gi.require_version('Gimp', '3.0')
 gi.require_version('GimpUi', '3.0')
 gi.require_version('Gtk', '3.0')
 
-from gi.repository import Gimp, GimpUi, Gtk, GLib, GObject
+from gi.repository import Gimp, GLib, GObject
 
 def N_(message): return message
 def _(message): return GLib.dgettext(None, message)
 
+#Milliseconds the checkpoint choice must stay unchanged before it is loaded on the backends
+PREWARM_DELAY = 1000
+
+#GimpUi.ICON_GEGL, without loading GTK to register the procedures
+ICON_NAME = "gimp-gegl"
+
+#GIMP runs the plug-in at every startup to register its procedures when its pluginrc is outdated. The UI and the
+#job modules are only loaded once a procedure runs, and the choices are registered from the metadata cache.
+def load_run_modules():
+    global GimpUi, Gtk, sd_api, sd_jobs
+
+    from gi.repository import GimpUi, Gtk
+    import sd_api
+    import sd_jobs
+
 class StableDiffusionPlugin (Gimp.PlugIn):
     style_list = []
+    prewarm_source = None
 
     def do_query_procedures(self):
+        #Only called at startup, the registration only waits for the WebUI when there is no cache to read the lists from
+        if sd_metadata.metadata_cache.is_cold():
+            sd_metadata.update_metadata(sd_metadata.METADATA_COLD_TIMEOUT)
+        sd_metadata.metadata_cache.offline = True
+        sd_metadata.save_registration()
+
         return [ 
             "text-to-image",
             "image-to-image",
@@ -34,7 +56,7 @@ class StableDiffusionPlugin (Gimp.PlugIn):
         procedure.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.DRAWABLE)
 
         procedure.set_menu_label(_(name.replace('-', ' ').title()))
-        procedure.set_icon_name(GimpUi.ICON_GEGL)
+        procedure.set_icon_name(ICON_NAME)
         procedure.add_menu_path('<Image>/Stableize/')
 
         procedure.set_documentation(_("Gimp hook for Automatic1111 Stable Diffusion WebUI"),
@@ -42,7 +64,10 @@ class StableDiffusionPlugin (Gimp.PlugIn):
                                         name)
         procedure.set_attribution("Stygian", "Stygian", "2024")
 
-    def create_choice_list(self, list, label_list = []):
+    #The default is added when missing, GIMP rejects an argument whose default is not one of its choices
+    def create_choice_list(self, list, label_list = [], default = None):
+        if default is not None and default not in list:
+            list = [default] + list
         choices = Gimp.Choice()
         id = 0
         for model in list:
@@ -51,6 +76,80 @@ class StableDiffusionPlugin (Gimp.PlugIn):
 
         return choices
 
+    def add_tiling_arguments(self, procedure):
+        procedure.add_boolean_argument('use_tiling', 'Tiled processing', 'Process the image in overlapping tiles, for images larger than the backend can handle at once', False, GObject.ParamFlags.READWRITE)
+        procedure.add_int_argument('tile_size', 'Tile size', 'Width and height of a tile, in pixels', 256, 4096, 1024, GObject.ParamFlags.READWRITE)
+        procedure.add_int_argument('tile_overlap', 'Tile overlap', 'Pixels shared by neighbouring tiles, blended to hide the seams', 0, 512, 64, GObject.ParamFlags.READWRITE)
+        procedure.add_int_argument('tile_concurrency', 'Tiles in flight', 'Maximum number of tiles exported or processed at once', 1, 16, 2, GObject.ParamFlags.READWRITE)
+
+    def fill_tiling_options(self, dialog):
+        box = dialog.fill_box('tiling-list', ['tile_size', 'tile_overlap', 'tile_concurrency'])
+        box.set_spacing(10)
+        box.set_orientation(Gtk.Orientation.HORIZONTAL)
+        dialog.fill_expander('tiling-options', 'use_tiling', False, 'tiling-list')
+
+    def add_sweep_arguments(self, procedure):
+        procedure.add_boolean_argument('use_sweep', 'Parameter sweep', 'Generate every combination of the values below from the same input, one image per seed. Values are lists (4, 6, 8) or ranges (20-40, 4-8:0.5)', False, GObject.ParamFlags.READWRITE)
+        procedure.add_string_argument('sweep_seeds', 'Seeds', 'Seeds of every variant, consecutive seeds are generated as one batch', '', GObject.ParamFlags.READWRITE)
+        procedure.add_string_argument('sweep_steps', 'Steps', 'Numbers of steps', '', GObject.ParamFlags.READWRITE)
+        procedure.add_string_argument('sweep_cfg_scale', 'CFG Scales', 'CFG scales', '', GObject.ParamFlags.READWRITE)
+        procedure.add_string_argument('sweep_samplers', 'Samplers', 'Sampler names, separated by commas', '', GObject.ParamFlags.READWRITE)
+        procedure.add_string_argument('sweep_denoising_strength', 'Denoising strengths', 'Denoising strengths', '', GObject.ParamFlags.READWRITE)
+        procedure.add_choice_argument('sweep_layout', 'Layout', 'How the results are inserted', self.create_choice_list(['layers', 'grid'], ['Labelled layers', 'Grid']), 'layers', GObject.ParamFlags.READWRITE)
+
+    def fill_sweep_options(self, dialog):
+        dialog.fill_box('sweep-list', ['sweep_seeds', 'sweep_steps', 'sweep_cfg_scale', 'sweep_samplers', 'sweep_denoising_strength', 'sweep_layout'])
+        dialog.fill_expander('sweep-options', 'use_sweep', False, 'sweep-list')
+
+    #The WebUI lists of the choice arguments of a procedure
+    def choice_lists(self, name):
+        match name:
+            case 'upscale':
+                return {'upscaler_1': sd_metadata.get_upscaler_models, 'upscaler_2': sd_metadata.get_upscaler_models}
+            case 'remove-background':
+                return {}
+
+        lists = {
+            'model': sd_metadata.get_models,
+            'refiner_checkpoint': sd_metadata.get_models,
+            'sampler_name': sd_metadata.get_samplers,
+            'scheduler': sd_metadata.get_schedulers,
+            'controlnet_model': lambda: sd_metadata.get_controlnet_models() + ['None'],
+            'controlnet_module': sd_metadata.get_controlnet_modules,
+        }
+        if name == 'text-to-image':
+            lists['hr_upscaler'] = lambda: sd_metadata.get_latent_upscale_modes() + sd_metadata.get_upscaler_models()
+
+        return lists
+
+    #The procedures were registered with the lists cached at startup. Before a run, the cache is brought up to date
+    #and the new entries are added to the choices, those the WebUI no longer lists are made insensitive since
+    #choices cannot be removed. Touching the plug-in file has GIMP register it again on its next startup.
+    def refresh_choices(self, procedure):
+        sd_metadata.update_metadata()
+
+        for argument, get_list in self.choice_lists(procedure.get_name()).items():
+            values = get_list()
+            if not values:
+                continue
+
+            choice = Gimp.param_spec_choice_get_choice(procedure.find_argument(argument))
+            nicks = list(choice.list_nicks())
+
+            for value in values:
+                if value not in nicks:
+                    nicks.append(value)
+                    choice.add(value, len(nicks), value, '')
+
+            for nick in nicks:
+                choice.set_sensitive(nick, nick in values)
+
+        if sd_metadata.is_registration_outdated():
+            try:
+                os.utime(os.path.abspath(__file__))
+            except OSError:
+                pass
+
     def do_create_procedure(self, name):
         if name in ["text-to-image", "image-to-image"]:
             procedure = Gimp.ImageProcedure.new(self, name,
@@ -62,40 +161,44 @@ class StableDiffusionPlugin (Gimp.PlugIn):
             procedure.add_string_argument('prompt', 'Positive prompt', 'Positive prompt for image generation', '', GObject.ParamFlags.READWRITE)
             procedure.add_string_argument('negative_prompt', 'Negative prompt', 'Negative prompt for image generation', '', GObject.ParamFlags.READWRITE)
 
-            for style in sd_api.get_styles():
+            for style in sd_metadata.get_styles():
                 procedure.add_boolean_argument(style['name'], style['name'], '+\t%s \n-\t%s' % (style['prompt'], style['negative_prompt']), False, GObject.ParamFlags.READWRITE)
                 self.style_list.append(style['name'])
 
             procedure.add_int_argument('steps', 'Steps', 'Number of steps', 5, 100, 12, GObject.ParamFlags.READWRITE)
             procedure.add_int_argument('n_iter', 'Batch count', 'Number of batches', 1, 10, 1, GObject.ParamFlags.READWRITE)
             procedure.add_int_argument('batch_size', 'Batch size', 'Number of pictures in a batch', 1, 50, 1, GObject.ParamFlags.READWRITE)
+            procedure.add_boolean_argument('progressive', 'Show batches as they finish', 'Send one request per batch so that every batch is inserted as soon as it is done, with the same seeds as a single request', True, GObject.ParamFlags.READWRITE)
 
-            models = self.create_choice_list(sd_api.get_models())  
-            current_model = sd_api.get_current_model()
+            current_model = sd_metadata.get_current_model()
+            models = self.create_choice_list(sd_metadata.get_models(), default = current_model)
             procedure.add_choice_argument('model', 'Checkpoint', 'Checkpoint', models, current_model, GObject.ParamFlags.READWRITE)
         
             procedure.add_boolean_argument('use_refiner', 'Use Refiner', '', False, GObject.ParamFlags.READWRITE)
             procedure.add_choice_argument('refiner_checkpoint', 'Checkpoint', 'Switch to another model during generation', models, current_model, GObject.ParamFlags.READWRITE)
             procedure.add_double_argument('refiner_switch_at', 'Switch at', 'Fraction of sampling steps where the switch should occur', 0, 1, 0.5, GObject.ParamFlags.READWRITE)
 
-            procedure.add_choice_argument('sampler_name', 'Sampler', 'Sampler', self.create_choice_list(sd_api.get_samplers()), "Euler a", GObject.ParamFlags.READWRITE)
-            procedure.add_choice_argument('scheduler', 'Scheduler', 'Scheduler', self.create_choice_list(sd_api.get_schedulers()), "Automatic", GObject.ParamFlags.READWRITE)
+            procedure.add_choice_argument('sampler_name', 'Sampler', 'Sampler', self.create_choice_list(sd_metadata.get_samplers(), default = "Euler a"), "Euler a", GObject.ParamFlags.READWRITE)
+            procedure.add_choice_argument('scheduler', 'Scheduler', 'Scheduler', self.create_choice_list(sd_metadata.get_schedulers(), default = "Automatic"), "Automatic", GObject.ParamFlags.READWRITE)
 
             procedure.add_double_argument('cfg_scale', 'CFG Scale', 'Classifier Free Guidance Scale - how strongly the image should conform to prompt - lower values produce more creative results', 1, 20, 6, GObject.ParamFlags.READWRITE)
 
             procedure.add_int_argument('seed', 'Seed', 'Generation seed', -999999, 999999, -1, GObject.ParamFlags.READWRITE)
+            procedure.add_boolean_argument('selection_only', 'Send selection only', 'Only upload the selected area instead of the whole canvas', True, GObject.ParamFlags.READWRITE)
 
             procedure.add_boolean_argument('use_control_net', 'Use ControlNet', '', False, GObject.ParamFlags.READWRITE)
-            procedure.add_choice_argument('controlnet_model', 'Model', 'ControlNet Model', self.create_choice_list(sd_api.get_controlnet_models() + ['None']), "None", GObject.ParamFlags.READWRITE)
-            procedure.add_choice_argument('controlnet_module', 'Module', 'ControlNet Module', self.create_choice_list(sd_api.get_controlnet_modules()), "none", GObject.ParamFlags.READWRITE)
+            procedure.add_choice_argument('controlnet_model', 'Model', 'ControlNet Model', self.create_choice_list(sd_metadata.get_controlnet_models() + ['None']), "None", GObject.ParamFlags.READWRITE)
+            procedure.add_choice_argument('controlnet_module', 'Module', 'ControlNet Module', self.create_choice_list(sd_metadata.get_controlnet_modules(), default = "none"), "none", GObject.ParamFlags.READWRITE)
             procedure.add_double_argument('controlnet_weight', 'Weight', 'How strong should the control be', 0, 2, 1, GObject.ParamFlags.READWRITE)
             procedure.add_double_argument('controlnet_start', 'Starting step', 'Fraction of sampling steps where the control should start', 0, 1, 0, GObject.ParamFlags.READWRITE)
             procedure.add_double_argument('controlnet_stop', 'Stopping step', 'Fraction of sampling steps where the control should end', 0, 1, 1, GObject.ParamFlags.READWRITE)
             procedure.add_double_argument('denoising_strength', 'Denoising strength', "Determines how little respect the algorithm should have for image's content. At 0, nothing will change, and at 1 you'll get an unrelated image. With values below 1.0, processing will take less steps than the Sampling Steps slider specifies.", 0, 1, 0.5, GObject.ParamFlags.READWRITE)
 
+            self.add_sweep_arguments(procedure)
+
             if name == 'text-to-image':
                 procedure.add_boolean_argument('enable_hr', 'Use Hires.  fix', '', False, GObject.ParamFlags.READWRITE)
-                procedure.add_choice_argument('hr_upscaler', 'Upscaler', 'Upscaler model used', self.create_choice_list(sd_api.get_latent_upscale_modes() + sd_api.get_upscaler_models()), 'None', GObject.ParamFlags.READWRITE)
+                procedure.add_choice_argument('hr_upscaler', 'Upscaler', 'Upscaler model used', self.create_choice_list(sd_metadata.get_latent_upscale_modes() + sd_metadata.get_upscaler_models(), default = 'None'), 'None', GObject.ParamFlags.READWRITE)
                 procedure.add_double_argument('hr_scale', 'Upscale by', 'Multiplier applied to image size', 1, 10, 2, GObject.ParamFlags.READWRITE)
                 procedure.add_int_argument('hr_second_pass_steps', 'Steps', 'Number of steps', 5, 100, 12, GObject.ParamFlags.READWRITE)              
             else:
@@ -106,6 +209,8 @@ class StableDiffusionPlugin (Gimp.PlugIn):
                 procedure.add_boolean_argument('inpainting_mask_invert', 'Inpaint masked', 'If unchecked, will inpaint everything but the masked area', True, GObject.ParamFlags.READWRITE)
                 procedure.add_boolean_argument('inpaint_full_res', 'Inpaint whole picture', 'If unchecked, will only process the masked area', True, GObject.ParamFlags.READWRITE)
                 procedure.add_double_argument('inpaint_full_res_padding', 'Only masked padding', 'No effect if Inpaint whole picture is checked', 0, 256, 32, GObject.ParamFlags.READWRITE)
+                procedure.add_int_argument('context_margin', 'Context margin', 'Pixels around the selection sent along with it as context', 0, 512, 64, GObject.ParamFlags.READWRITE)
+                self.add_tiling_arguments(procedure)
 
         elif name == "upscale":
             procedure = Gimp.ImageProcedure.new(self, name,
@@ -115,10 +220,11 @@ class StableDiffusionPlugin (Gimp.PlugIn):
             self.init_procedure(name, procedure)
             
             procedure.add_double_argument('upscaling_resize', 'Upscale by', 'Multiplier applied to image size', 1, 10, 2, GObject.ParamFlags.READWRITE)
-            upscaler_models = self.create_choice_list(sd_api.get_upscaler_models())
+            upscaler_models = self.create_choice_list(sd_metadata.get_upscaler_models(), default = 'None')
             procedure.add_choice_argument('upscaler_1', 'Upscaler 1', 'First upscaler model used', upscaler_models, 'None', GObject.ParamFlags.READWRITE)
             procedure.add_choice_argument('upscaler_2', 'Upscaler 2', 'Second upscaler model used', upscaler_models, 'None', GObject.ParamFlags.READWRITE)
             procedure.add_double_argument('extras_upscaler_2_visibility', 'Upscaler 2 visibility', 'Weight of the second upscaler', 0, 1, 0, GObject.ParamFlags.READWRITE)
+            self.add_tiling_arguments(procedure)
         else:
             procedure = Gimp.ImageProcedure.new(self, name,
                                     Gimp.PDBProcType.PLUGIN,
@@ -126,7 +232,7 @@ class StableDiffusionPlugin (Gimp.PlugIn):
 
             self.init_procedure(name, procedure)
 
-            procedure.add_choice_argument('model', 'Model', 'Remove background model', self.create_choice_list(sd_api.get_rembg_models()), 'None', GObject.ParamFlags.READWRITE)
+            procedure.add_choice_argument('model', 'Model', 'Remove background model', self.create_choice_list(sd_metadata.get_rembg_models()), 'None', GObject.ParamFlags.READWRITE)
             procedure.add_boolean_argument('return_mask', 'Return mask', 'Returns used mask instead of foreground', False, GObject.ParamFlags.READWRITE)
             procedure.add_boolean_argument('alpha_matting', 'Alpha matting', 'Alpha matting is a post processing step that can be used to improve the quality of the output.', False, GObject.ParamFlags.READWRITE)
 
@@ -136,18 +242,78 @@ class StableDiffusionPlugin (Gimp.PlugIn):
         
         return procedure
     
-    def get_config(self, config):
-        config_data = {}
+    #Loads the chosen checkpoint while the dialog is open, once the user stopped browsing the list
+    def schedule_prewarm(self, config):
+        if self.prewarm_source is not None:
+            GLib.source_remove(self.prewarm_source)
+
+        self.prewarm_source = GLib.timeout_add(PREWARM_DELAY, self.prewarm, config)
+
+    def prewarm(self, config):
+        self.prewarm_source = None
+        #Empty when registered without any cached checkpoint, the WebUI then keeps its own
+        if config.get_property('model'):
+            sd_api.prewarm(config.get_property('model'))
+
+        return False
+
+    #Submits the first job, then lets the user queue more while the results are inserted as they arrive
+    def run_jobs(self, procedure, dialog, submit):
+        jobs = []
+
+        #Values the jobs cannot be built from, such as a malformed sweep, are reported and the dialog shown again
+        def submit_from_dialog(accepted):
+            while accepted:
+                try:
+                    jobs.append(sd_jobs.submit(*submit()))
+                    return True
+                except ValueError as error:
+                    Gimp.message(str(error))
+                    accepted = dialog.run()
 
-        for property in dir(config.props):
-            if property != 'procedure':
-                config_data[property] = config.get_property(property)
+            return False
 
-        return config_data
+        def add_from_dialog():
+            submit_from_dialog(dialog.run())
+            dialog.hide()
+
+        if not submit_from_dialog(True):
+            dialog.destroy()
+            return procedure.new_return_values(Gimp.PDBStatusType.CANCEL, GLib.Error())
+
+        dialog.hide()
+
+        window = sd_api.JobQueueWindow(sd_api.job_queue, add_from_dialog, lambda: sd_jobs.insert_results(jobs))
+        window.run()
+        dialog.destroy()
+
+        return self.job_return_values(procedure, jobs)
+
+    def run_jobs_headless(self, procedure, submit):
+        try:
+            jobs = [sd_jobs.submit(*submit())]
+        except ValueError as error:
+            return procedure.new_return_values(Gimp.PDBStatusType.CALLING_ERROR, GLib.Error(str(error)))
+
+        sd_jobs.wait(jobs)
+
+        return self.job_return_values(procedure, jobs)
+
+    def job_return_values(self, procedure, jobs):
+        sd_jobs.close(jobs)
+
+        error = sd_jobs.first_error(jobs)
+        if error is not None:
+            return procedure.new_return_values(Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(error))
+
+        return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
 
     def run_remove_bg(self, procedure, run_mode, image, drawables, config, run_data):
+        load_run_modules()
+
         if run_mode == Gimp.RunMode.INTERACTIVE:
             GimpUi.init( "sd_plugin.py" )
+            self.refresh_choices(procedure)
 
             dialog = GimpUi.ProcedureDialog(procedure=procedure, config=config)
 
@@ -160,52 +326,57 @@ class StableDiffusionPlugin (Gimp.PlugIn):
 
             dialog.fill(['model', 'return_mask', 'alpha_matting_expander'])
 
-            if not dialog.run():
+            speculation = sd_jobs.speculate(procedure.get_name(), image, config)
+            accepted = dialog.run()
+            speculation.cancel()
+
+            if not accepted:
                 dialog.destroy()
                 return procedure.new_return_values(
                     Gimp.PDBStatusType.CANCEL, GLib.Error()
                 )
-            else:
-                dialog.destroy()
 
-            config_data = self.get_config(config)
-            config_data["input_image"] = gimp_utils.get_image_as_base64(image)
+            return self.run_jobs(procedure, dialog, lambda: sd_jobs.remove_bg(procedure.get_name(), image, sd_jobs.get_config(config)))
 
-            generated_image = sd_api.remove_bg(config_data)
-            gimp_utils.load_base64_image(generated_image, image)
+        return self.run_jobs_headless(procedure, lambda: sd_jobs.remove_bg(procedure.get_name(), image, sd_jobs.get_config(config)))
 
-        return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
 
     def run_upscale(self, procedure, run_mode, image, drawables, config, run_data):
+        load_run_modules()
+
         if run_mode == Gimp.RunMode.INTERACTIVE:
             GimpUi.init( "sd_plugin.py" )
+            self.refresh_choices(procedure)
 
             dialog = GimpUi.ProcedureDialog(procedure=procedure, config=config)
 
             dialog.get_widget('upscaling_resize', GimpUi.ScaleEntry).set_digits(1)
             dialog.get_widget('extras_upscaler_2_visibility', GimpUi.ScaleEntry).set_digits(2)
+            self.fill_tiling_options(dialog)
+
+            dialog.fill(['upscaling_resize', 'upscaler_1', 'upscaler_2', 'extras_upscaler_2_visibility', 'tiling-options'])
 
-            dialog.fill()
+            speculation = sd_jobs.speculate(procedure.get_name(), image, config)
+            accepted = dialog.run()
+            speculation.cancel()
 
-            if not dialog.run():
+            if not accepted:
                 dialog.destroy()
                 return procedure.new_return_values(
                     Gimp.PDBStatusType.CANCEL, GLib.Error()
                 )
-            else:
-                dialog.destroy()
 
-            config_data = self.get_config(config)
-            config_data["image"] = gimp_utils.get_image_as_base64(image)
+            return self.run_jobs(procedure, dialog, lambda: sd_jobs.upscale(procedure.get_name(), image, sd_jobs.get_config(config)))
+
+        return self.run_jobs_headless(procedure, lambda: sd_jobs.upscale(procedure.get_name(), image, sd_jobs.get_config(config)))
 
-            generated_image = sd_api.upscale(config_data)
-            gimp_utils.load_base64_image(generated_image, image)
 
-        return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
-    
     def run_generation(self, procedure, run_mode, image, drawables, config, run_data):
+        load_run_modules()
+
         if run_mode == Gimp.RunMode.INTERACTIVE:
             GimpUi.init( "sd_plugin.py" )
+            self.refresh_choices(procedure)
 
             dialog = GimpUi.ProcedureDialog(procedure=procedure, config=config)
 
@@ -261,7 +432,7 @@ class StableDiffusionPlugin (Gimp.PlugIn):
 
             dialog.get_widget('steps', GimpUi.ScaleEntry)
 
-            box = dialog.fill_box('batch-list', ['n_iter', 'batch_size'])
+            box = dialog.fill_box('batch-list', ['n_iter', 'batch_size', 'progressive'])
             box.set_spacing(10)
             box.set_orientation(Gtk.Orientation.HORIZONTAL)
 
@@ -280,7 +451,14 @@ class StableDiffusionPlugin (Gimp.PlugIn):
             box.set_spacing(10)
             box.set_orientation(Gtk.Orientation.HORIZONTAL)
 
-            dialog.fill_box('generation-list', ['model', 'refiner-options', 'sampler-options', 'cfg_scale', 'seed'])
+            roi_fields = ['selection_only']
+            if procedure.get_name() == 'image-to-image':
+                roi_fields.append('context_margin')
+            box = dialog.fill_box('roi-options', roi_fields)
+            box.set_spacing(10)
+            box.set_orientation(Gtk.Orientation.HORIZONTAL)
+
+            dialog.fill_box('generation-list', ['model', 'refiner-options', 'sampler-options', 'cfg_scale', 'seed', 'roi-options'])
             expander = dialog.fill_expander('generation-options', 'generation-label', False, 'generation-list')
             expander.set_expanded(True)
             dialog.get_widget('model', GObject.TYPE_NONE).set_margin_top(10)
@@ -300,73 +478,31 @@ class StableDiffusionPlugin (Gimp.PlugIn):
             dialog.fill_box('controlnet-list', ['controlnet-model-list', 'controlnet-sliders-list'])
             dialog.fill_expander('controlnet-options', 'use_control_net', False, 'controlnet-list')    
 
-            dialog.fill(['prompt-options', 'steps', 'batch-list', 'generation-options', 'controlnet-options'])
+            main_fields = ['prompt-options', 'steps', 'batch-list', 'generation-options', 'controlnet-options']
+            if procedure.get_name() == 'image-to-image':
+                self.fill_tiling_options(dialog)
+                main_fields.append('tiling-options')
+
+            self.fill_sweep_options(dialog)
+            main_fields.append('sweep-options')
+
+            dialog.fill(main_fields)
+
+            config.connect('notify::model', lambda config, param: self.schedule_prewarm(config))
+            self.schedule_prewarm(config)
 
-            if not dialog.run():
+            speculation = sd_jobs.speculate(procedure.get_name(), image, config)
+            accepted = dialog.run()
+            speculation.cancel()
+
+            if not accepted:
                 dialog.destroy()
                 return procedure.new_return_values(
                     Gimp.PDBStatusType.CANCEL, GLib.Error()
                 )
-            else:
-                dialog.destroy()
 
-            styles = []
-            for style in self.style_list:
-                if config.get_property(style):
-                    styles.append(style)
-
-            success, non_empty, x1, y1, x2, y2 = Gimp.Selection.bounds(image)
-
-            config_data = self.get_config(config) | {
-                "width": abs(x1 - x2) if non_empty else image.get_width(),
-                "height": abs(y1 - y2) if non_empty else image.get_height(),
-                "styles": styles,
-                "override_settings": {"sd_model_checkpoint": config.get_property('model')},
-            }
-
-            if config_data['use_control_net']:
-                config_data['alwayson_scripts'] = {
-                    "controlnet": {
-                        "args": [
-                            {
-                                "enabled": True,
-                                "image": gimp_utils.get_image_as_base64(image),
-                                "model": config_data['controlnet_model'],
-                                "module": config_data['controlnet_module'],
-                                "weight": config_data['controlnet_weight'],
-                                "guidance_start": config_data['controlnet_start'],
-                                "guidance_end": config_data['controlnet_stop']
-                            }
-                        ]
-                    }
-                }
-
-            match procedure.get_name():
-                case 'text-to-image':
-                    generated_images = sd_api.txt_to_img(config_data)
-                case 'image-to-image':
-                    inpainting_mask = config_data['mask']
-
-                    if inpainting_mask:
-                        copied_mask = gimp_utils.copy_layer(image, inpainting_mask)
-                        config_data['mask'] = gimp_utils.get_image_as_base64(image)
-                        image.remove_layer(copied_mask)
-                        inpainting_mask.set_visible(False)
-
-                    config_data["init_images"] = [gimp_utils.get_image_as_base64(image)]
-
-                    if inpainting_mask: inpainting_mask.set_visible(True)
-
-                    generated_images = sd_api.img_to_img(config_data)
-            
-            i = -1
-            for base64_image in generated_images:
-                i += 1
-                if i == 0 and len(generated_images) > 1:
-                    continue
-
-                gimp_utils.load_base64_image(base64_image, image)
+            return self.run_jobs(procedure, dialog, lambda: sd_jobs.generation(procedure.get_name(), image, sd_jobs.get_config(config), self.style_list))
 
-        return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
+        return self.run_jobs_headless(procedure, lambda: sd_jobs.generation(procedure.get_name(), image, sd_jobs.get_config(config), self.style_list))
 
 Gimp.main(StableDiffusionPlugin.__gtype__, sys.argv)
\ No newline at end of file
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import itertools
+import re
+
+#Parameter sweeps: every combination of the values given for the swept parameters is generated from the same
+#input. Values are lists separated by commas ("4, 6, 8"), ranges ("20-40") or ranges with a step ("4-8:0.5").
+#The WebUI gives the images of a batch consecutive seeds, so variants that only differ by consecutive seeds
+#are sent as one request with a larger batch size.
+
+#(argument holding the values, request parameter, label, value type), in the order the variants are nested.
+#Seeds come last so that the variants differing only by seed follow each other.
+SWEEP_PARAMETERS = [
+    ("sweep_samplers", "sampler_name", "sampler", str),
+    ("sweep_steps", "steps", "steps", int),
+    ("sweep_cfg_scale", "cfg_scale", "cfg", float),
+    ("sweep_denoising_strength", "denoising_strength", "denoise", float),
+    ("sweep_seeds", "seed", "seed", int),
+]
+
+#Largest batch size seeds are merged into, bounded by the backend's memory
+SWEEP_MAX_BATCH = 8
+SWEEP_MAX_VARIANTS = 256
+
+RANGE_PATTERN = re.compile(r"^(-?\d+(?:\.\d*)?)\s*-\s*(-?\d+(?:\.\d*)?)(?:\s*:\s*(\d+(?:\.\d*)?))?$")
+
+def parse_values(text, value_type):
+    values = []
+
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+
+        match = RANGE_PATTERN.match(item) if value_type is not str else None
+        if match is None:
+            values.append(value_type(item))
+            continue
+
+        #Converting the bounds with the value type rejects "1.5-3" for integer parameters
+        start, stop, step = value_type(match[1]), value_type(match[2]), value_type(match[3] or 1)
+        if step <= 0 or stop < start:
+            raise ValueError("Empty range '%s'" % item)
+
+        #Counting steps avoids the float drift of repeated additions
+        count = int((stop - start) / step + 1e-9) + 1
+        values.extend(value_type(round(start + index * step, 6)) for index in range(count))
+
+    return values
+
+#The swept parameters with their values, those left empty are not swept
+def get_sweeps(config_data):
+    sweeps = []
+
+    for argument, parameter, label, value_type in SWEEP_PARAMETERS:
+        text = config_data.get(argument) or ""
+
+        try:
+            values = parse_values(text, value_type)
+        except ValueError:
+            raise ValueError("Invalid %s sweep '%s'" % (label, text))
+
+        if values:
+            sweeps.append((parameter, label, values))
+
+    return sweeps
+
+def format_value(value):
+    return "%g" % value if isinstance(value, float) else str(value)
+
+#Requests running every variant, as (parameters, labels of the returned images), and the number of variants per
+#row of a grid, which is the number of values of the innermost swept parameter. `seed` replaces a random seed,
+#so that the variants only differ by the swept parameters.
+def plan_requests(config_data, seed):
+    sweeps = get_sweeps(config_data)
+    if not sweeps:
+        raise ValueError("No parameter to sweep")
+
+    if sweeps[-1][0] != "seed":
+        sweeps.append(("seed", "seed", [seed]))
+
+    variant_count = 1
+    for parameter, label, values in sweeps:
+        variant_count *= len(values)
+    if variant_count > SWEEP_MAX_VARIANTS:
+        raise ValueError("%d variants, at most %d can be swept at once" % (variant_count, SWEEP_MAX_VARIANTS))
+
+    requests = []
+    others, seeds = sweeps[:-1], sweeps[-1][2]
+
+    for combination in itertools.product(*[values for parameter, label, values in others]):
+        parameters = {parameter: value for (parameter, label, values), value in zip(others, combination)}
+        label = ", ".join("%s %s" % (name, format_value(value)) for (parameter, name, values), value in zip(others, combination))
+
+        for run in consecutive_runs(seeds):
+            labels = [", ".join(filter(None, [label, "seed %d" % run_seed if len(seeds) > 1 else ""])) for run_seed in run]
+            requests.append((parameters | {"seed": run[0], "batch_size": len(run), "n_iter": 1}, labels))
+
+    columns = len(sweeps[-1][2]) if len(seeds) > 1 or not others else len(others[-1][2])
+
+    return requests, columns
+
+#Splits seeds into runs of consecutive values, at most SWEEP_MAX_BATCH long
+def consecutive_runs(seeds):
+    runs = []
+
+    for seed in seeds:
+        if runs and seed == runs[-1][-1] + 1 and len(runs[-1]) < SWEEP_MAX_BATCH:
+            runs[-1].append(seed)
+        else:
+            runs.append([seed])
+
+    return runs
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import sd_cache
+
+#Opt-in timing of every stage of a run, from the export to the layer insertion:
+#   SD_PLUGIN_TRACE=1                   rotating log in the cache directory
+#   SD_PLUGIN_TRACE=/path/trace.log     rotating log at this path
+#   SD_PLUGIN_TRACE=/path/trace.json    Chrome trace events, open with chrome://tracing or ui.perfetto.dev
+#A summary line of every run is also printed on stderr.
+TRACE = os.environ.get("SD_PLUGIN_TRACE", "")
+TRACE_LOG_PATH = os.path.join(sd_cache.CACHE_DIR, "trace.log")
+TRACE_LOG_BYTES = 2**20
+TRACE_LOG_BACKUPS = 3
+
+#Stages in pipeline order for the summary, any other span follows them
+SUMMARY_STAGES = ["queued", "fingerprint", "export", "cache", "build", "compress", "upload", "backend", "download", "parse", "decode", "insert"]
+
+#Spans are recorded in the run bound to the current thread, and dropped when there is none
+local = threading.local()
+run_ids = itertools.count(1)
+
+class Span:
+
+    def __init__(self, run, name, args):
+        self.run = run
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        return self.args
+
+    def __exit__(self, *exception):
+        self.run.add(self.name, self.started_at, time.perf_counter() - self.started, self.args)
+
+class NullRun:
+
+    def bound(self):
+        return nullcontext()
+
+    def finish(self, label, status, queued_at = None, queued = 0):
+        pass
+
+NULL_RUN = NullRun()
+
+class Run:
+
+    def __init__(self, label):
+        self.id = next(run_ids)
+        self.label = label
+        self.started_at = time.time()
+        self.spans = []
+        self.finished = False
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def bound(self):
+        previous = getattr(local, "run", None)
+        local.run = self
+        try:
+            yield self
+        finally:
+            local.run = previous
+
+    def add(self, name, started_at, duration, args):
+        with self.lock:
+            self.spans.append((name, started_at, duration, threading.current_thread().name, args))
+
+    def summary(self, status):
+        totals = {}
+        sent = received = saved = 0
+
+        for name, started_at, duration, thread, args in self.spans:
+            totals[name] = totals.get(name, 0) + duration
+            saved += args.get("saved_s", 0)
+            if name == "upload":
+                sent += args.get("bytes", 0)
+            elif name == "download":
+                received += args.get("bytes", 0)
+
+        names = [name for name in SUMMARY_STAGES if name in totals] + sorted(set(totals) - set(SUMMARY_STAGES))
+
+        return "run %d '%s' %s in %.3fs: %s - %.2f MB sent, %.2f MB received%s" % (
+            self.id, self.label, status, time.time() - self.started_at,
+            ", ".join("%s %.3fs" % (name, totals[name]) for name in names),
+            sent / 2**20, received / 2**20, ", ~%.3fs saved by compression" % saved if saved else ""
+        )
+
+    #Spans of concurrent tiles or requests overlap, their stage totals can exceed the run time
+    def finish(self, label, status, queued_at = None, queued = 0):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+            self.label = label
+
+        if queued_at is not None:
+            self.add("queued", queued_at, queued, {})
+
+        summary = self.summary(status)
+        get_writer().write(self, summary)
+        print(summary, file=sys.stderr)
+
+class LogWriter:
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.logger = logging.getLogger("sd_trace")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+        handler = RotatingFileHandler(path, maxBytes=TRACE_LOG_BYTES, backupCount=TRACE_LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(process)d %(message)s"))
+        self.logger.addHandler(handler)
+
+    def write(self, run, summary):
+        for name, started_at, duration, thread, args in sorted(run.spans, key=lambda span: span[1]):
+            self.logger.info("run %d %-11s +%.3fs %.3fs %s%s" % (
+                run.id, name, started_at - run.started_at, duration, thread, " " + json.dumps(args) if args else ""))
+
+        self.logger.info(summary)
+
+#Chrome's JSON array format allows the closing bracket to be missing, so every process can append to the same file
+class ChromeTraceWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.thread_ids = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    #Thread ids must be numbers, the names are attached as metadata events
+    def thread_id(self, name, pid, events):
+        if name not in self.thread_ids:
+            self.thread_ids[name] = len(self.thread_ids) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": self.thread_ids[name], "args": {"name": name}})
+
+        return self.thread_ids[name]
+
+    def write(self, run, summary):
+        pid = os.getpid()
+        events = []
+
+        with self.lock:
+            for name, started_at, duration, thread, args in run.spans:
+                events.append({
+                    "name": name, "cat": run.label, "ph": "X", "pid": pid, "tid": self.thread_id(thread, pid, events),
+                    "ts": round(started_at * 1e6), "dur": round(duration * 1e6), "args": args | {"run": run.id}
+                })
+
+            events.append({"name": "summary", "ph": "i", "s": "p", "pid": pid, "tid": self.thread_id(threading.current_thread().name, pid, events),
+                           "ts": round(time.time() * 1e6), "args": {"run": run.id, "summary": summary}})
+
+        with self.lock, open(self.path, "a") as file:
+            if file.tell() == 0:
+                file.write("[\n")
+            for event in events:
+                file.write(json.dumps(event) + ",\n")
+
+writer = None
+
+def get_writer():
+    global writer
+
+    if writer is None:
+        if TRACE.endswith(".json"):
+            writer = ChromeTraceWriter(TRACE)
+        else:
+            writer = LogWriter(TRACE_LOG_PATH if TRACE in ("1", "log") else TRACE)
+
+    return writer
+
+def start(label):
+    return Run(label) if TRACE else NULL_RUN
+
+def span(name, **args):
+    run = getattr(local, "run", None)
+    if run is None:
+        return nullcontext(args)
+
+    return Span(run, name, args)
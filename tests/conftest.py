@@ -0,0 +1,45 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_DIR = os.path.join(ROOT, "sd_plugin")
+MOCK_WEBUI = os.path.join(ROOT, "benchmarks", "mock_webui.py")
+
+sys.path.insert(0, PLUGIN_DIR)
+
+#The caches, the registration digest and the trace log go to a directory of their own, read at import time
+os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="sd-plugin-tests-")
+
+#Starts benchmarks/mock_webui.py, the extra arguments are passed on to it. Returns its base URL.
+@pytest.fixture(scope="module")
+def start_mock():
+    processes = []
+
+    def start(*arguments):
+        process = subprocess.Popen([sys.executable, MOCK_WEBUI, "--port", "0", *arguments], stdout=subprocess.PIPE, text=True)
+        processes.append(process)
+        return process.stdout.readline().strip().rstrip("/") + "/"
+
+    yield start
+
+    for process in processes:
+        process.kill()
+        process.wait()
+
+@pytest.fixture(scope="module")
+def mock_url(start_mock):
+    return start_mock("--latency", "0.2")
+
+#A port nothing listens on
+@pytest.fixture
+def dead_url():
+    with socket.socket() as closed:
+        closed.bind(("127.0.0.1", 0))
+        port = closed.getsockname()[1]
+
+    return "http://127.0.0.1:%d/" % port
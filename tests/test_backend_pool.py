@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+try:
+    import sd_api
+except (ImportError, ValueError) as error:
+    pytest.skip("sd_api needs PyGObject with Gtk 3 and GdkPixbuf: %s" % error, allow_module_level=True)
+
+def test_healthy_never_waits_for_the_backends(monkeypatch, dead_url):
+    checks = []
+
+    def check(backend):
+        checks.append(threading.current_thread().name)
+        time.sleep(0.5)
+        backend.healthy = False
+        backend.checked_at = time.time()
+
+    monkeypatch.setattr(sd_api.Backend, "check", check)
+    pool = sd_api.BackendPool([dead_url, dead_url])
+
+    started = time.monotonic()
+    assert pool.healthy() == pool.backends
+    assert time.monotonic() - started < 0.1
+    assert checks == []
+
+    #Acquiring, on a job worker, checks them first
+    assert pool.acquire() is pool.backends[0]
+    assert len(checks) == 2
+    assert pool.healthy() == pool.backends[:1]
+
+def test_backend_pool_skips_unreachable_backends(mock_url, dead_url):
+    pool = sd_api.BackendPool([dead_url, mock_url])
+    first, second = pool.acquire(), pool.acquire()
+
+    assert [backend.base_url for backend in pool.healthy()] == [mock_url]
+    assert first is second and first.base_url == mock_url and first.active == 2
+
+    pool.release(first)
+    pool.release(second)
+    assert first.active == 0
+
+def test_backend_pool_falls_back_to_first_backend(dead_url):
+    pool = sd_api.BackendPool([dead_url])
+    pool.refresh()
+
+    assert pool.healthy() == pool.backends[:1]
+    assert not pool.backends[0].healthy
+
+def test_backend_pool_prefers_loaded_checkpoint(mock_url):
+    pool = sd_api.BackendPool([mock_url, mock_url])
+    pool.backends[1].checkpoint = ("mock-xl", None)
+
+    assert pool.acquire(("mock-xl", None)) is pool.backends[1]
+    #The least loaded backend wins over the checkpoint
+    assert pool.acquire(("mock-xl", None)) is pool.backends[0]
+
+def test_backend_restores_the_download_options(monkeypatch, start_mock):
+    url = start_mock()
+    options_url = url + sd_api.API_PATH + "options"
+    monkeypatch.setattr(sd_api, "DOWNLOAD_FORMAT", ("jpeg", 85))
+    backend = sd_api.Backend(url)
+
+    backend.configure()
+    backend.configure()
+    assert sd_api.session.get_json(options_url)["samples_format"] == "jpg"
+    assert sd_api.session.get_json(options_url)["jpeg_quality"] == 85
+
+    #Restored once the last request on the backend is done
+    backend.restore()
+    assert sd_api.session.get_json(options_url)["samples_format"] == "jpg"
+    backend.restore()
+
+    options = sd_api.session.get_json(options_url)
+    assert (options["samples_format"], options["jpeg_quality"], options["webp_lossless"]) == ("png", 80, False)
+    assert backend.saved_options is None
+
+def test_download_options():
+    assert sd_api.download_options(("png", 1)) == {"samples_format": "png"}
+    assert sd_api.download_options(("webp", "lossless")) == {"samples_format": "webp", "webp_lossless": True}
+    assert sd_api.download_options(("jpeg", 70)) == {"samples_format": "jpg", "jpeg_quality": 70, "webp_lossless": False}
@@ -0,0 +1,122 @@
+import base64
+import struct
+import zlib
+
+import pytest
+
+import image_codec
+
+#Reads back what iter_png writes: filter type 0 on every row, 8-bit rows or packed 1-bit grayscale
+def decode_png(encoded):
+    data = base64.b64decode(encoded)
+    assert data.startswith(image_codec.PNG_SIGNATURE)
+
+    position, chunks = len(image_codec.PNG_SIGNATURE), []
+    while position < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        crc, = struct.unpack(">I", data[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(chunk, zlib.crc32(chunk_type))
+
+        chunks.append((chunk_type, chunk))
+        position += 12 + length
+
+    assert chunks[0][0] == b"IHDR" and chunks[-1][0] == b"IEND"
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", chunks[0][1][:10])
+    channels = {value: key for key, value in image_codec.PNG_COLOR_TYPES.items()}[color_type]
+
+    raw = zlib.decompress(b"".join(chunk for chunk_type, chunk in chunks if chunk_type == b"IDAT"))
+    stride = (width * channels * bit_depth + 7) // 8
+    rows = [raw[offset:offset + stride + 1] for offset in range(0, len(raw), stride + 1)]
+    assert len(rows) == height and all(row[0] == 0 for row in rows)
+
+    pixels = b"".join(row[1:] for row in rows)
+    if bit_depth == 1:
+        bits = "".join(format(byte, "08b") for byte in pixels)
+        pixels = bytes(255 if bits[row * stride * 8 + column] == "1" else 0 for row in range(height) for column in range(width))
+
+    return width, height, channels, pixels
+
+def strips(pixels, row_bytes, rows_per_strip):
+    step = row_bytes * rows_per_strip
+    return [pixels[offset:offset + step] for offset in range(0, len(pixels), step)]
+
+@pytest.mark.parametrize("channels", [1, 2, 3, 4])
+def test_png_round_trip(channels):
+    width, height = 13, 7
+    pixels = bytes((index * 37) % 256 for index in range(width * height * channels))
+
+    encoded, size = image_codec.encode_png_base64(width, height, channels, strips(pixels, width * channels, 3))
+
+    assert decode_png(encoded) == (width, height, channels, pixels)
+    assert size == len(base64.b64decode(encoded))
+
+def test_base64_writer_matches_single_encode():
+    writer = image_codec.Base64Writer()
+    data = bytes(range(256)) * 3
+    for offset in range(0, len(data), 7):
+        writer.write(data[offset:offset + 7])
+
+    assert writer.getvalue() == base64.b64encode(data).decode("ascii")
+    assert writer.size == len(data)
+
+def test_binary_mask_round_trip():
+    width, height = 11, 5
+    pixels = bytes(255 if (x + y) % 3 else 0 for y in range(height) for x in range(width))
+    mask_strips = strips(pixels, width, 2)
+
+    assert image_codec.is_binary(mask_strips)
+    packed = [image_codec.pack_bits(strip, width) for strip in mask_strips]
+    encoded = image_codec.encode_png_base64(width, height, 1, packed, bit_depth=1)[0]
+
+    assert decode_png(encoded) == (width, height, 1, pixels)
+
+def test_is_binary_rejects_gray():
+    assert not image_codec.is_binary([b"\x00\xff", b"\x00\x80"])
+
+@pytest.mark.parametrize("start, length, tile, overlap", [(0, 1000, 256, 32), (40, 777, 300, 64), (0, 512, 256, 0)])
+def test_split_axis_covers_with_overlap(start, length, tile, overlap):
+    spans = image_codec.split_axis(start, length, tile, overlap)
+
+    assert spans[0][0] == start
+    assert spans[-1][0] + spans[-1][1] == start + length
+    assert all(size == tile for position, size in spans)
+    for (previous, size), (position, _) in zip(spans, spans[1:]):
+        assert previous < position and previous + size - position >= overlap
+
+def test_split_axis_single_tile():
+    assert image_codec.split_axis(10, 200, 256, 32) == [(10, 200)]
+
+def test_ramp_mask():
+    width, height, left, top = 6, 5, 2, 3
+    mask = image_codec.ramp_mask(width, height, left, top)
+
+    columns, rows = image_codec.ramp(width, left), image_codec.ramp(height, top)
+
+    assert columns[0] < columns[1] < columns[left] == 255
+    assert rows[0] < rows[1] < rows[2] < rows[top] == 255
+    assert mask == bytes(min(column, row) for row in rows for column in columns)
+    assert mask[(height - 1) * width + left:] == b"\xff" * (width - left)
+
+@pytest.mark.parametrize("spec, expected", [
+    (None, None),
+    ("", None),
+    ("png", ("png", 1)),
+    ("PNG:6", ("png", 6)),
+    ("jpg:85", ("jpeg", 85)),
+    ("webp", ("webp", 90)),
+    ("webp:lossless", ("webp", "lossless")),
+])
+def test_parse_format(spec, expected):
+    assert image_codec.parse_format(spec) == expected
+
+@pytest.mark.parametrize("spec", ["gif", "png:fast", "jpeg:lossless"])
+def test_parse_format_errors(spec):
+    with pytest.raises(ValueError):
+        image_codec.parse_format(spec)
+
+def test_format_from_env_falls_back(monkeypatch, capsys):
+    monkeypatch.setenv("SD_PLUGIN_TEST_FORMAT", "gif")
+
+    assert image_codec.format_from_env("SD_PLUGIN_TEST_FORMAT", ("png", 1)) == ("png", 1)
+    assert "SD_PLUGIN_TEST_FORMAT" in capsys.readouterr().err
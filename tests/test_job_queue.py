@@ -0,0 +1,83 @@
+import contextlib
+import time
+
+import pytest
+
+try:
+    import sd_api
+except (ImportError, ValueError) as error:
+    pytest.skip("sd_api needs PyGObject with Gtk 3 and GdkPixbuf: %s" % error, allow_module_level=True)
+
+@pytest.fixture
+def backends(monkeypatch):
+    def use(*base_urls):
+        pool = sd_api.BackendPool(list(base_urls))
+        monkeypatch.setattr(sd_api, "backend_pool", pool)
+        monkeypatch.setattr(sd_api.progress_poller, "watching", lambda base_url: contextlib.nullcontext())
+        return pool
+
+    return use
+
+def wait_for(condition, timeout = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def running_job(queue, base_url):
+    job = sd_api.Job("test", None)
+    job.status = sd_api.Job.RUNNING
+    job.backends.append(sd_api.Backend(base_url))
+    queue.running.append(job)
+
+    return job
+
+def test_cancel_interrupts_the_running_generation(start_mock, backends):
+    backends(start_mock("--latency", "5"))
+    queue = sd_api.JobQueue(1)
+    job = queue.submit(sd_api.create_job("test", sd_api.API_PATH + "txt2img", {"seed": -1, "width": 64, "height": 64}, "images"))
+    wait_for(lambda: job.backends)
+    time.sleep(0.2)
+
+    started = time.monotonic()
+    queue.cancel(job)
+    assert time.monotonic() - started < 0.1
+
+    wait_for(job.is_finished, timeout = 3)
+    assert job.status == sd_api.Job.CANCELLED
+
+def test_unreachable_backends_are_ignored(dead_url):
+    queue = sd_api.JobQueue(1)
+    job = running_job(queue, dead_url)
+
+    queue.skip()
+    queue.cancel(job)
+    assert job.cancel_requested
+
+def test_next_job_prefers_the_loaded_checkpoint(backends, dead_url, monkeypatch):
+    monkeypatch.setattr(sd_api, "SCHEDULER_MAX_SKIPS", 3)
+    pool = backends(dead_url)
+    pool.backends[0].checkpoint = ("loaded", None)
+    queue = sd_api.JobQueue(1)
+
+    labels = ["other", "loaded 1", "loaded 2", "loaded 3", "loaded 4"]
+    for label in labels:
+        job = sd_api.Job(label, None)
+        job.checkpoint = (label.split()[0], None)
+        queue.pending.append(job)
+
+    order = [queue.next_job().label for label in labels]
+
+    #Passed over SCHEDULER_MAX_SKIPS times at most
+    assert order == ["loaded 1", "loaded 2", "loaded 3", "other", "loaded 4"]
+
+def test_next_job_starts_jobs_without_checkpoint(backends, dead_url):
+    backends(dead_url)
+    queue = sd_api.JobQueue(1)
+
+    first, upscale = sd_api.Job("first", None), sd_api.Job("upscale", None)
+    first.checkpoint = ("other", None)
+    queue.pending.extend([first, upscale])
+
+    assert queue.next_job() is upscale
+    assert first.skipped == 1
@@ -0,0 +1,70 @@
+import pytest
+
+try:
+    import sd_api
+except (ImportError, ValueError) as error:
+    pytest.skip("sd_api needs PyGObject with Gtk 3 and GdkPixbuf: %s" % error, allow_module_level=True)
+
+#Records the requests post_split sends instead of sending them
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+
+    def post_parts(job, path, requests, cacheable, window_size):
+        sent.append((requests, window_size))
+        return iter([])
+
+    def post(job, path, data, key, cacheable = None):
+        sent.append(([data], None))
+        return iter([])
+
+    monkeypatch.setattr(sd_api.Job, "post_parts", post_parts)
+    monkeypatch.setattr(sd_api.Job, "post", post)
+    return sent
+
+def split(monkeypatch, backends, data, progressive = False):
+    monkeypatch.setattr(sd_api.backend_pool, "refresh", lambda: None)
+    monkeypatch.setattr(sd_api.backend_pool, "healthy", lambda: [None] * backends)
+    job = sd_api.Job("test", None)
+
+    return list(job.post_split("txt2img", data, progressive))
+
+def seeds(requests):
+    return [(data["seed"], data["n_iter"]) for data in requests]
+
+def test_post_split_between_backends(monkeypatch, sent):
+    split(monkeypatch, 2, {"n_iter": 5, "batch_size": 2, "seed": 100})
+
+    requests, window_size = sent[0]
+    assert seeds(requests) == [(100, 3), (106, 2)]
+    assert window_size == 2
+
+def test_post_split_progressive(monkeypatch, sent):
+    split(monkeypatch, 1, {"n_iter": 3, "batch_size": 1, "seed": 7}, progressive = True)
+
+    requests, window_size = sent[0]
+    assert seeds(requests) == [(7, 1), (8, 1), (9, 1)]
+    assert window_size == sd_api.PIPELINE_DEPTH
+
+def test_post_split_draws_random_seed_once(monkeypatch, sent):
+    monkeypatch.setattr(sd_api.random, "randrange", lambda stop: 1000)
+    split(monkeypatch, 3, {"n_iter": 3, "batch_size": 4, "seed": -1})
+
+    assert seeds(sent[0][0]) == [(1000, 1), (1004, 1), (1008, 1)]
+
+def test_post_split_single_request(monkeypatch, sent):
+    data = {"n_iter": 4, "batch_size": 1, "seed": -1}
+    split(monkeypatch, 1, data)
+
+    assert sent == [([data], None)]
+
+def test_job_splits_between_mock_backends(monkeypatch, mock_url):
+    pool = sd_api.BackendPool([mock_url, mock_url])
+    monkeypatch.setattr(sd_api, "backend_pool", pool)
+
+    job = sd_api.txt_to_img_job("test", {"prompt": "", "n_iter": 3, "batch_size": 2, "seed": -1, "width": 64, "height": 64})
+    images = list(job.task(job))
+
+    assert len(images) == 6
+    assert {backend for backend in job.backends} == set(pool.backends)
+    assert all(backend.active == 0 for backend in pool.backends)
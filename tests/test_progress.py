@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+try:
+    import sd_api
+except (ImportError, ValueError) as error:
+    pytest.skip("sd_api needs PyGObject with Gtk 3 and GdkPixbuf: %s" % error, allow_module_level=True)
+
+@pytest.mark.parametrize("fraction, eta, interval", [
+    (0, 30, sd_api.PROGRESS_MAX_INTERVAL),
+    (0.5, 1000, sd_api.PROGRESS_MAX_INTERVAL),
+    (0.5, 10, 10 * sd_api.PROGRESS_ETA_FRACTION),
+    (0.9, 0.1, sd_api.PROGRESS_MIN_INTERVAL),
+])
+def test_interval_follows_the_eta(fraction, eta, interval):
+    progress = sd_api.BackendProgress()
+    progress.fraction, progress.eta = fraction, eta
+
+    assert progress.interval() == pytest.approx(interval)
+
+def test_unreachable_backends_are_polled_at_the_slowest_rate(dead_url):
+    progress = sd_api.BackendProgress()
+    sd_api.ProgressPoller().poll(dead_url, progress)
+
+    assert progress.poll_at - time.time() == pytest.approx(sd_api.PROGRESS_MAX_INTERVAL, abs=0.5)
+
+def test_polls_get_closer_as_the_generation_ends(start_mock):
+    url = start_mock("--latency", "3")
+    poller, progress = sd_api.ProgressPoller(), sd_api.BackendProgress()
+    #No live preview, the poll only reads the progress
+    progress.preview_at = time.time() + 60
+
+    poller.poll(url, progress)
+    assert progress.fraction == 0
+    assert progress.poll_at - time.time() == pytest.approx(sd_api.PROGRESS_MAX_INTERVAL, abs=0.5)
+
+    data = {"n_iter": 1, "batch_size": 1, "width": 64, "height": 64}
+    generation = threading.Thread(target=sd_api.session.post_json, args=(url + sd_api.API_PATH + "txt2img", data))
+    generation.start()
+    time.sleep(2.5)
+
+    poller.poll(url, progress)
+    generation.join()
+    assert 0 < progress.fraction < 1
+    assert progress.interval() < sd_api.PROGRESS_MAX_INTERVAL
@@ -0,0 +1,67 @@
+import contextlib
+import threading
+import time
+
+import pytest
+
+try:
+    import sd_api
+except (ImportError, ValueError) as error:
+    pytest.skip("sd_api needs PyGObject with Gtk 3 and GdkPixbuf: %s" % error, allow_module_level=True)
+
+def waiting(window, index, job):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(window.wait(index, job)), daemon=True)
+    thread.start()
+
+    return thread, result
+
+def test_window_lets_parts_start_in_turn():
+    window, job = sd_api.RequestWindow(2), sd_api.Job("test", None)
+
+    assert window.wait(0, job) and window.wait(1, job)
+
+    thread, result = waiting(window, 2, job)
+    thread.join(0.2)
+    assert thread.is_alive()
+
+    window.release()
+    thread.join(1)
+    assert result == [True]
+
+@pytest.mark.parametrize("stop", [
+    lambda window, job: window.stop(),
+    lambda window, job: setattr(job, "cancel_requested", True),
+])
+def test_window_releases_waiting_parts(stop):
+    window, job = sd_api.RequestWindow(1), sd_api.Job("test", None)
+    thread, result = waiting(window, 1, job)
+    thread.join(0.1)
+
+    stop(window, job)
+    thread.join(1)
+    assert result == [False]
+
+def test_cancel_stops_the_queued_parts(monkeypatch, start_mock):
+    url = start_mock("--latency", "1")
+    monkeypatch.setattr(sd_api, "backend_pool", sd_api.BackendPool([url]))
+    monkeypatch.setattr(sd_api.progress_poller, "watching", lambda base_url: contextlib.nullcontext())
+    queue = sd_api.JobQueue(1)
+
+    data = {"n_iter": 4, "batch_size": 1, "seed": 1, "width": 64, "height": 64, "progressive": True}
+    job = queue.submit(sd_api.txt_to_img_job("test", data))
+    deadline = time.monotonic() + 5
+    while not job.backends:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    queue.cancel(job)
+    while not job.is_finished():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    #Each of the parts queued behind the interrupted one would take another second
+    assert time.monotonic() - started < 1
+    assert job.status == sd_api.Job.CANCELLED
+    assert job.image_count < 4
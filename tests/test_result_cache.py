@@ -0,0 +1,73 @@
+import contextlib
+import weakref
+
+import pytest
+
+try:
+    import sd_api
+except (ImportError, ValueError) as error:
+    pytest.skip("sd_api needs PyGObject with Gtk 3 and GdkPixbuf: %s" % error, allow_module_level=True)
+
+class StreamedImage(str):
+    pass
+
+#Sends the requests of Job.post nowhere, `stream` answers them
+@pytest.fixture
+def offline_backend(monkeypatch, dead_url):
+    pool = sd_api.BackendPool([dead_url])
+    monkeypatch.setattr(pool, "healthy", lambda: pool.backends)
+    monkeypatch.setattr(sd_api, "backend_pool", pool)
+    monkeypatch.setattr(sd_api.progress_poller, "watching", lambda base_url: contextlib.nullcontext())
+
+    def answer(stream):
+        monkeypatch.setattr(sd_api.session, "post_json_stream", lambda url, data, key, **options: stream())
+
+    return answer
+
+def test_uncached_images_are_not_retained(offline_backend):
+    count = 16
+    references = []
+
+    def stream():
+        for index in range(count):
+            image = StreamedImage("image %d" % index)
+            references.append(weakref.ref(image))
+            yield image
+            del image
+
+        #Only the last image may still be referenced, by the consumer
+        assert [reference() is None for reference in references[:-1]] == [True] * (count - 1)
+
+    offline_backend(stream)
+    job = sd_api.Job("test", None)
+
+    assert sum(1 for image in job.post("txt2img", {"n_iter": count, "seed": -1}, "images")) == count
+
+def test_cacheable_results_are_cached(offline_backend):
+    data = {"n_iter": 2, "batch_size": 1, "seed": 3}
+    offline_backend(lambda: iter(["a", "b"]))
+
+    assert list(sd_api.Job("test", None).post("txt2img", data, "images")) == ["a", "b"]
+
+    offline_backend(lambda: iter(["not", "sent"]))
+    assert list(sd_api.Job("test", None).post("txt2img", data, "images")) == ["a", "b"]
+
+def test_incomplete_results_are_not_cached(offline_backend):
+    data = {"n_iter": 3, "batch_size": 1, "seed": 4}
+    offline_backend(lambda: iter(["a"]))
+    list(sd_api.Job("test", None).post("txt2img", data, "images"))
+
+    assert sd_api.result_cache.get(sd_api.result_key("txt2img", data, "images")) is None
+
+def test_is_deterministic():
+    assert sd_api.is_deterministic({}, "image")
+    assert sd_api.is_deterministic({"seed": 5}, "images")
+    assert not sd_api.is_deterministic({"seed": -1}, "images")
+    assert not sd_api.is_deterministic({}, "images")
+
+def test_result_key_covers_the_payload():
+    key = sd_api.result_key("txt2img", {"prompt": "a", "seed": 1}, "images")
+
+    assert key == sd_api.result_key("txt2img", {"seed": 1, "prompt": "a"}, "images")
+    assert key != sd_api.result_key("txt2img", {"prompt": "b", "seed": 1}, "images")
+    assert key != sd_api.result_key("img2img", {"prompt": "a", "seed": 1}, "images")
@@ -0,0 +1,61 @@
+import pytest
+
+try:
+    import sd_batch
+except (ImportError, ValueError) as error:
+    pytest.skip("sd_batch runs in GIMP, it needs PyGObject: %s" % error, allow_module_level=True)
+
+import sd_api
+
+#Runs the batch without GIMP nor backend, `fail` lists the files that cannot be loaded
+@pytest.fixture
+def run(monkeypatch, tmp_path):
+    submitted = []
+
+    def submit(item, procedure_name, config_data):
+        submitted.append(item.name)
+        if item.name in fail:
+            raise OSError("cannot load %s" % item.name)
+
+        item.job = sd_api.Job(item.name, None)
+        item.job.status = sd_api.Job.DONE
+
+    def report(item, output_dir):
+        return {"file": item.name, "status": item.job.status, "outputs": item.name}
+
+    monkeypatch.setattr(sd_batch.BatchItem, "submit", submit)
+    monkeypatch.setattr(sd_batch.BatchItem, "report", report)
+    monkeypatch.setattr(sd_batch.sd_jobs, "insert_results", lambda jobs: None)
+    monkeypatch.setattr(sd_batch.sd_jobs, "get_config", lambda config: {})
+    monkeypatch.setattr(sd_batch.sd_metadata, "update_metadata", lambda: None)
+    fail = set()
+
+    def run_batch(*names, failing = ()):
+        fail.clear()
+        fail.update(failing)
+        submitted.clear()
+        input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+        input_dir.mkdir(exist_ok=True)
+        for name in names:
+            (input_dir / name).write_bytes(b"")
+
+        summary = sd_batch.run_directory("upscale", str(input_dir), str(output_dir))
+        return summary, list(submitted), sd_batch.read_report(str(output_dir / sd_batch.REPORT_NAME))
+
+    return run_batch
+
+def test_batch_reports_every_file(run):
+    summary, submitted, report = run("b.png", "a.jpg", "notes.txt", "c.webp", failing = {"c.webp"})
+
+    assert submitted == ["a.jpg", "b.png", "c.webp"]
+    assert summary == {sd_api.Job.DONE: 2, sd_api.Job.FAILED: 1}
+    assert {name: row["status"] for name, row in report.items()} == {"a.jpg": "done", "b.png": "done", "c.webp": "failed"}
+    assert report["c.webp"]["error"] == "cannot load c.webp"
+
+def test_batch_resumes_after_the_files_done(run):
+    run("a.png", "b.png", failing = {"b.png"})
+    summary, submitted, report = run("a.png", "b.png", "c.png")
+
+    assert submitted == ["b.png", "c.png"]
+    assert summary == {sd_api.Job.DONE: 2}
+    assert {name: row["status"] for name, row in report.items()} == {"a.png": "done", "b.png": "done", "c.png": "done"}
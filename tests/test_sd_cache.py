@@ -0,0 +1,79 @@
+import os
+
+import sd_cache
+
+def test_lru_evicts_least_recently_used():
+    cache = sd_cache.LRUCache(10)
+    cache.put("a", 1, 4)
+    cache.put("b", 2, 4)
+
+    #Reading "a" makes "b" the least recently used
+    assert cache.get("a") == 1
+    cache.put("c", 3, 4)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.size == 8
+
+def test_lru_evicts_until_it_fits():
+    cache = sd_cache.LRUCache(10)
+    for key in "abcd":
+        cache.put(key, key, 3)
+    cache.put("e", "e", 7)
+
+    assert [key for key in "abcde" if cache.contains(key)] == ["d", "e"]
+    assert cache.size == 10
+
+def test_lru_replacing_updates_size():
+    cache = sd_cache.LRUCache(10)
+    cache.put("a", 1, 6)
+    cache.put("a", 2, 3)
+
+    assert cache.get("a") == 2
+    assert cache.size == 3
+
+def test_lru_skips_oversized_values():
+    cache = sd_cache.LRUCache(10)
+    cache.put("a", 1, 4)
+    cache.put("big", 2, 11)
+
+    assert not cache.contains("big")
+    assert cache.get("a") == 1
+
+def test_lru_counts_hits_and_misses():
+    cache = sd_cache.LRUCache(10)
+    cache.put("a", 1, 1)
+    cache.get("a")
+    cache.get("b")
+    cache.contains("a")
+
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+def test_disk_cache_round_trip(tmp_path):
+    cache = sd_cache.DiskCache(str(tmp_path / "cache"), 10)
+
+    assert cache.get("a") is None
+    cache.put("a", b"1234")
+
+    assert cache.get("a") == b"1234"
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = sd_cache.DiskCache(str(tmp_path / "cache"), 10)
+    for index, key in enumerate("abc"):
+        cache.put(key, b"123")
+        os.utime(cache.path(key), (index, index))
+
+    #Reading "a" makes "b" the least recently used
+    cache.get("a")
+    cache.put("d", b"123")
+
+    assert [key for key in "abcd" if os.path.exists(cache.path(key))] == ["a", "c", "d"]
+
+def test_disk_cache_skips_oversized_values(tmp_path):
+    cache = sd_cache.DiskCache(str(tmp_path / "cache"), 10)
+    cache.put("a", b"1234")
+    cache.put("big", b"x" * 11)
+
+    assert cache.get("big") is None
+    assert cache.get("a") == b"1234"
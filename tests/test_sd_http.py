@@ -0,0 +1,141 @@
+import http.client
+import http.server
+import io
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import sd_http
+
+#GET answers "ok". POST answers after `delay` seconds, or drops the connection unanswered when `drop_posts` is set.
+#With `close_idle`, the server closes the connection after answering without telling the client.
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.posts += 1
+
+        if self.server.drop_posts:
+            self.close_connection = True
+            return
+
+        time.sleep(self.server.delay)
+        self.answer()
+
+    def answer(self):
+        body = b'{"result": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = self.server.close_idle
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.posts = 0
+    server.delay = 0
+    server.drop_posts = False
+    server.close_idle = False
+    server.url = "http://127.0.0.1:%d/" % server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+def test_connections_are_reused(server):
+    session = sd_http.Session(timeout = 5)
+
+    for index in range(3):
+        assert session.get_json(server.url) == {"result": "ok"}
+
+    assert session.stats()["connections_opened"] == 1
+    assert session.stats()["connections_reused"] == 2
+
+def test_connections_closed_by_the_server_are_not_reused(server):
+    server.close_idle = True
+    session = sd_http.Session(timeout = 5)
+    session.get_json(server.url)
+    time.sleep(0.2)
+
+    assert session.post_json(server.url, {}) == {"result": "ok"}
+    assert session.stats()["connections_opened"] == 2
+    assert session.stats()["retries"] == 0
+    assert server.posts == 1
+
+def test_refused_requests_are_retried(dead_url):
+    session = sd_http.Session(timeout = 5, retries = 2, retry_backoff = 0)
+
+    with pytest.raises(ConnectionRefusedError):
+        session.post_json(dead_url, {})
+
+    assert session.stats()["retries"] == 2
+
+def test_sent_posts_are_never_retried(server):
+    server.drop_posts = True
+    session = sd_http.Session(timeout = 5, retries = 2, retry_backoff = 0)
+
+    with pytest.raises((OSError, http.client.HTTPException)):
+        session.post_json(server.url, {})
+
+    assert server.posts == 1
+    assert session.stats()["retries"] == 0
+
+def test_read_timeout(server):
+    server.delay = 0.5
+    session = sd_http.Session(timeout = 0.2, retries = 2)
+
+    with pytest.raises(socket.timeout):
+        session.post_json(server.url, {})
+
+    assert session.post_json(server.url, {}, read_timeout = sd_http.UNBOUNDED) == {"result": "ok"}
+    assert server.posts == 2
+
+class ChunkedResponse(io.BytesIO):
+
+    def __init__(self, data, chunk_size):
+        super().__init__(data)
+        self.chunk_size = chunk_size
+
+    #Never returns more than chunk_size, like a socket delivering the body piece by piece
+    def read(self, size = -1):
+        return super().read(self.chunk_size if size < 0 else min(size, self.chunk_size))
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 1 << 16])
+def test_iter_json_strings(chunk_size):
+    images = ["aGVsbG8=", 'quote " and \\ backslash', "", "é\n"]
+    body = json.dumps({"images": images, "parameters": {}, "info": "{\"images\": []}"}, indent=1).encode()
+
+    assert list(sd_http.iter_json_strings(ChunkedResponse(body, chunk_size), "images")) == images
+
+def test_iter_json_strings_key_split_across_chunks(monkeypatch):
+    monkeypatch.setattr(sd_http, "STREAM_CHUNK_SIZE", 5)
+    body = b'{"parameters": {}, "images" : [ "a", "b" ], "info": ""}'
+
+    assert list(sd_http.iter_json_strings(io.BytesIO(body), "images")) == ["a", "b"]
+
+def test_iter_json_strings_missing_key():
+    assert list(sd_http.iter_json_strings(io.BytesIO(b'{"detail": "Not Found"}'), "images")) == []
+
+def test_iter_json_strings_drains_body():
+    response = ChunkedResponse(b'{"images": ["a"], "info": "' + b"x" * 1000 + b'"}', 16)
+    list(sd_http.iter_json_strings(response, "images"))
+
+    assert response.read() == b""
+
+def test_iter_json_strings_truncated():
+    with pytest.raises(ValueError):
+        list(sd_http.iter_json_strings(io.BytesIO(b'{"images": ["a", "b'), "images"))
@@ -0,0 +1,112 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+import sd_metadata
+
+#Serves {"value": <version>} with an ETag, and answers 304 while the version is unchanged
+class MetadataHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get("If-None-Match"))
+        etag = '"%d"' % server.version
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps({"value": server.version}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MetadataHandler)
+    server.requests = []
+    server.version = 1
+    server.url = "http://127.0.0.1:%d/" % server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def cache(tmp_path):
+    return sd_metadata.MetadataCache(str(tmp_path / "metadata.json"))
+
+def fetch(cache, base_url, uri = "options"):
+    for future in cache.prefetch([(uri, base_url)]):
+        future.result(timeout = 10)
+
+def test_cold_cache_fetches_and_saves(cache, server):
+    assert cache.is_cold()
+    fetch(cache, server.url)
+
+    assert not cache.is_cold()
+    assert sd_metadata.MetadataCache(cache.path).get("options", server.url) == {"value": 1}
+
+def test_fresh_entries_are_not_refetched(cache, server):
+    fetch(cache, server.url)
+
+    assert cache.prefetch([("options", server.url)]) == []
+    assert len(server.requests) == 1
+
+def test_outdated_entries_are_revalidated_with_their_etag(cache, server, monkeypatch):
+    fetch(cache, server.url)
+    fetched_at = cache.entries[server.url + "options"]["fetched_at"]
+    monkeypatch.setitem(sd_metadata.METADATA_TTL, "options", 0)
+
+    fetch(cache, server.url)
+    assert server.requests == [None, '"1"']
+    assert cache.entries[server.url + "options"]["fetched_at"] > fetched_at
+
+    server.version = 2
+    fetch(cache, server.url)
+    assert cache.get("options", server.url) == {"value": 2}
+
+def test_offline_get_never_fetches(cache, server):
+    cache.offline = True
+
+    assert cache.get("options", server.url, "default") == "default"
+    assert cache.pending == {}
+    assert server.requests == []
+
+def test_unreachable_backend_keeps_the_stale_entry(cache, server, monkeypatch, dead_url):
+    fetch(cache, server.url)
+    entry = cache.entries[server.url + "options"]
+    cache.entries[dead_url + "options"] = entry
+    monkeypatch.setitem(sd_metadata.METADATA_TTL, "options", 0)
+
+    fetch(cache, dead_url)
+    assert cache.entries[dead_url + "options"] is entry
+    assert cache.get("options", dead_url) == {"value": 1}
+
+def test_registration_digest_follows_the_lists(tmp_path, monkeypatch):
+    monkeypatch.setattr(sd_metadata, "REGISTRATION_PATH", str(tmp_path / "registration.json"))
+    monkeypatch.setattr(sd_metadata, "metadata_cache", sd_metadata.MetadataCache(str(tmp_path / "metadata.json")))
+    sd_metadata.metadata_cache.offline = True
+    models = sd_metadata.SD_API_URL + "sd-models"
+
+    #Nothing saved yet, nothing to compare with
+    assert not sd_metadata.is_registration_outdated()
+
+    sd_metadata.metadata_cache.entries[models] = {"data": [{"title": "a"}], "fetched_at": 0}
+    sd_metadata.save_registration()
+    digest = sd_metadata.registration_digest()
+    assert not sd_metadata.is_registration_outdated()
+
+    sd_metadata.metadata_cache.entries[models] = {"data": [{"title": "a"}, {"title": "b"}], "fetched_at": 0}
+    assert sd_metadata.registration_digest() != digest
+    assert sd_metadata.is_registration_outdated()
@@ -0,0 +1,48 @@
+import pytest
+
+import sd_sweep
+
+def test_parse_values():
+    assert sd_sweep.parse_values("4, 6,8", int) == [4, 6, 8]
+    assert sd_sweep.parse_values("20-24:2, 30", int) == [20, 22, 24, 30]
+    assert sd_sweep.parse_values("0.3-0.7:0.1", float) == [0.3, 0.4, 0.5, 0.6, 0.7]
+    assert sd_sweep.parse_values("Euler a, DDIM", str) == ["Euler a", "DDIM"]
+    assert sd_sweep.parse_values(" , ", int) == []
+
+@pytest.mark.parametrize("text, value_type", [("1.5-3", int), ("1-3:0.5", int), ("5-3", int), ("1-2:0", float), ("x", int)])
+def test_parse_values_errors(text, value_type):
+    with pytest.raises(ValueError):
+        sd_sweep.parse_values(text, value_type)
+
+def test_consecutive_runs():
+    assert sd_sweep.consecutive_runs([1, 2, 3, 7, 8, 4]) == [[1, 2, 3], [7, 8], [4]]
+    assert sd_sweep.consecutive_runs(list(range(10))) == [list(range(sd_sweep.SWEEP_MAX_BATCH)), [8, 9]]
+
+def test_plan_requests_batches_consecutive_seeds():
+    requests, columns = sd_sweep.plan_requests({"sweep_steps": "10, 20", "sweep_seeds": "5-7, 9"}, 42)
+
+    assert [data for data, labels in requests] == [
+        {"steps": 10, "seed": 5, "batch_size": 3, "n_iter": 1},
+        {"steps": 10, "seed": 9, "batch_size": 1, "n_iter": 1},
+        {"steps": 20, "seed": 5, "batch_size": 3, "n_iter": 1},
+        {"steps": 20, "seed": 9, "batch_size": 1, "n_iter": 1},
+    ]
+    assert requests[0][1] == ["steps 10, seed 5", "steps 10, seed 6", "steps 10, seed 7"]
+    assert columns == 4
+
+def test_plan_requests_uses_the_given_seed():
+    requests, columns = sd_sweep.plan_requests({"sweep_cfg_scale": "4-5:0.5"}, 42)
+
+    assert [(data["cfg_scale"], data["seed"], data["batch_size"]) for data, labels in requests] == [(4.0, 42, 1), (4.5, 42, 1), (5.0, 42, 1)]
+    assert [labels for data, labels in requests] == [["cfg 4"], ["cfg 4.5"], ["cfg 5"]]
+    assert columns == 3
+
+def test_plan_requests_errors():
+    with pytest.raises(ValueError, match="No parameter"):
+        sd_sweep.plan_requests({}, 1)
+
+    with pytest.raises(ValueError, match="steps"):
+        sd_sweep.plan_requests({"sweep_steps": "1.5-3"}, 1)
+
+    with pytest.raises(ValueError, match="variants"):
+        sd_sweep.plan_requests({"sweep_steps": "1-100", "sweep_cfg_scale": "1-3"}, 1)
@@ -0,0 +1,70 @@
+import json
+import threading
+
+import sd_trace
+
+def test_summary_lists_the_stages_in_pipeline_order():
+    run = sd_trace.Run("test")
+    run.add("backend", 0, 1.0, {})
+    run.add("custom", 0, 0.5, {})
+    run.add("upload", 0, 0.25, {"bytes": 2**20, "saved_s": 0.125})
+    run.add("upload", 0, 0.25, {"bytes": 2**20})
+    run.add("download", 0, 0.5, {"bytes": 2**19})
+    run.add("fingerprint", 0, 0.1, {})
+
+    summary = run.summary("done")
+
+    assert summary.startswith("run %d 'test' done in " % run.id)
+    assert "fingerprint 0.100s, upload 0.500s, backend 1.000s, download 0.500s, custom 0.500s" in summary
+    assert summary.endswith("2.00 MB sent, 0.50 MB received, ~0.125s saved by compression")
+
+def test_spans_go_to_the_run_bound_to_the_thread():
+    run = sd_trace.Run("test")
+
+    with sd_trace.span("export") as args:
+        args["cache"] = "miss"
+
+    with run.bound():
+        with sd_trace.span("export", bytes=10) as args:
+            args["cache"] = "miss"
+
+        #Other threads record nothing unless they bind the run too
+        def decode():
+            with sd_trace.span("decode"):
+                pass
+
+        thread = threading.Thread(target=decode)
+        thread.start()
+        thread.join()
+
+    assert [(name, args) for name, started_at, duration, thread, args in run.spans] == [("export", {"bytes": 10, "cache": "miss"})]
+
+def test_runs_finish_once(monkeypatch, capsys):
+    written = []
+    monkeypatch.setattr(sd_trace, "get_writer", lambda: type("Writer", (), {"write": lambda self, run, summary: written.append(summary)})())
+    run = sd_trace.Run("test")
+
+    run.finish("renamed", "done", queued_at = 0, queued = 0.5)
+    run.finish("renamed", "done")
+
+    assert len(written) == 1 and "'renamed' done" in written[0] and "queued 0.500s" in written[0]
+    assert capsys.readouterr().err == written[0] + "\n"
+
+def test_chrome_trace_appends_runs(tmp_path):
+    writer = sd_trace.ChromeTraceWriter(str(tmp_path / "trace.json"))
+
+    for label in ["first", "second"]:
+        run = sd_trace.Run(label)
+        run.add("backend", run.started_at, 0.5, {"bytes": 1})
+        writer.write(run, run.summary("done"))
+
+    with open(writer.path) as file:
+        text = file.read()
+
+    #The closing bracket is left out so that the file can be appended to
+    events = json.loads(text.rstrip().rstrip(",") + "]")
+    spans = [event for event in events if event["ph"] == "X"]
+
+    assert [event["cat"] for event in spans] == ["first", "second"]
+    assert spans[0]["dur"] == 500000 and spans[0]["args"]["bytes"] == 1
+    assert [event["args"]["summary"] for event in events if event["name"] == "summary"][1].startswith("run %d 'second'" % run.id)